@@ -6,6 +6,7 @@ from datetime import datetime
 import shutil
 from PIL import Image
 from utils import process_upload
+from palette import to_layers, DEFAULT_DITHER
 try:
     from zoneinfo import ZoneInfo
 except ImportError:
@@ -111,25 +112,9 @@ def download_and_convert_icon(icon_id):
         bg = Image.new("RGBA", img_raw.size, (255, 255, 255, 255))
         img = Image.alpha_composite(bg, img_raw).convert("RGB")
         
-        # 2. THE PROCESS_UPLOAD PALETTE LOGIC
-        palettedata = [255, 255, 255,  0, 0, 0,  255, 0, 0] # White, Black, Red
-        palettedata.extend([0] * (768 - len(palettedata)))
-        palimage = Image.new('P', (1, 1))
-        palimage.putpalette(palettedata)
-        img_converted = img.quantize(palette=palimage)
+        # 2. The same 3-color palette split as process_upload
+        img_black, img_red = to_layers(img)
         
-        img_black = Image.new('1', img.size, 255)
-        img_red = Image.new('1', img.size, 255)
-        
-        p_black = img_black.load()
-        p_red = img_red.load()
-        p_old = img_converted.load()
-        
-        for y in range(img.size[1]):
-            for x in range(img.size[0]):
-                if p_old[x, y] == 1: p_black[x,y] = 0   # Draw to Black Layer
-                elif p_old[x, y] == 2: p_red[x,y] = 0   # Draw to Red Layer
-                
         # 3. Save both layers with their unique icon IDs
         img_black.save(path_b)
         img_red.save(path_r)
@@ -240,7 +225,17 @@ def download_image(url, save_path):
         print(f"[-] Image Download Error: {e}")
         return False
 
-def get_picture_of_the_day(source="nasa", api_key="", upload_dir="uploads"):
+POTD_MAX_AGE = 43200
+POTD_FRAME = 'potd.epd'
+
+def get_cached_potd(source, max_age_seconds=POTD_MAX_AGE):
+    """The cached POTD metadata for a source if its image was downloaded and is fresh enough, else None."""
+    cached = get_cached_data(f'potd_meta_{source}.json', max_age_seconds)
+    if cached and os.path.exists(os.path.join(CACHE_DIR, f'potd_raw_{source}.jpg')):
+        return cached
+    return None
+
+def get_picture_of_the_day(source="nasa", api_key="", upload_dir="uploads", dither=DEFAULT_DITHER):
     """
     Fetches a daily image from the specified source, downloads it, 
     and processes it for the 3-color e-ink display.
@@ -249,9 +244,9 @@ def get_picture_of_the_day(source="nasa", api_key="", upload_dir="uploads"):
     cache_meta_file = f'potd_meta_{source}.json'
     raw_image_path = os.path.join(CACHE_DIR, f'potd_raw_{source}.jpg')
     
-    # Check Cache (12 hours = 43200 seconds)
-    cached = get_cached_data(cache_meta_file, max_age_seconds=43200)
-    if cached and os.path.exists(raw_image_path):
+    # Check Cache (12 hours)
+    cached = get_cached_potd(source)
+    if cached:
         return cached
 
     img_url = None
@@ -296,8 +291,8 @@ def get_picture_of_the_day(source="nasa", api_key="", upload_dir="uploads"):
         # Download and Process
         if img_url and download_image(img_url, raw_image_path):
             print(f"[*] Successfully downloaded {source} POTD. Processing palette...")
-            # This slices the raw image into the Black and Red BMP layers for Page 3!
-            process_upload(raw_image_path, upload_dir)
+            # This slices the raw image into the packed Black and Red frame for Page 3!
+            process_upload(raw_image_path, upload_dir, dither, name=POTD_FRAME)
             save_to_cache(cache_meta_file, meta_data)
             return meta_data
         else:
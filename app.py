@@ -1,11 +1,16 @@
 import os
+import math
 import time
 import glob
-from PIL import Image
 from flask import Flask, render_template, request, redirect, url_for, jsonify,send_from_directory
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
-from utils import save_state, setup_new_wifi, ensure_fallback_ap, process_upload, calculate_bw_diff
+from utils import save_state, setup_new_wifi, ensure_fallback_ap, ingest_upload, open_image, calculate_bw_diff
+from jobs import submit, get_job
+from frames import save_layers
+from palette import DITHER_ENGINES, DEFAULT_DITHER
+from quote_store import remove_store
+from quote_manager import start_precompute, precompute_progress
 
 
 UPLOAD_DIR = 'uploads'
@@ -27,6 +32,28 @@ def create_app(state_ref, trigger_full_refresh, trigger_partial_refresh):
     app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024 # 16MB max upload
     CORS(app)
 
+    def dither_for(setting):
+        """The upload's own 'dither' field if it names an engine, else the saved setting for its destination."""
+        dither = request.form.get('dither')
+        return dither if dither in DITHER_ENGINES else state_ref.get(setting, DEFAULT_DITHER)
+
+    def form_number(name, cast, minimum):
+        """A numeric form field clamped to at least minimum, or None if it's missing or not a (finite) number."""
+        try:
+            value = cast(request.form.get(name, ''))
+        except ValueError:
+            return None
+        return max(minimum, value) if math.isfinite(value) else None
+
+    def accepted(job_ids):
+        """
+        Reply for uploads handed to the worker pool: browsers go back to the UI, API clients
+        (Accept: application/json) get the job ids to poll at /api/jobs/<id>.
+        """
+        if request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json':
+            return jsonify({"status": "accepted", "jobs": job_ids}), 202
+        return redirect(url_for('index'))
+
     @app.route('/', methods=['GET', 'POST'])
     def index():
         if request.method == 'POST':
@@ -77,6 +104,18 @@ def create_app(state_ref, trigger_full_refresh, trigger_partial_refresh):
                 state_ref['tz3_name'] = request.form.get('tz3_name', 'TYO')
                 state_ref['tz3_zone'] = request.form.get('tz3_zone', 'Asia/Tokyo')
 
+                if request.form.get('fast_full_refresh'): state_ref['fast_full_refresh'] = request.form.get('fast_full_refresh')
+                # Dithering engine per destination: single photo, slideshow, and each POTD source
+                if request.form.get('dither_photo') in DITHER_ENGINES: state_ref['dither_photo'] = request.form.get('dither_photo')
+                if request.form.get('dither_slideshow') in DITHER_ENGINES: state_ref['dither_slideshow'] = request.form.get('dither_slideshow')
+                if request.form.get('dither_potd') in DITHER_ENGINES: state_ref.setdefault('dither_potd', {})[state_ref['potd_source']] = request.form.get('dither_potd')
+                # Ghosting budget: partial refreshes allowed before the panel gets a full clean
+                # (a zero budget would mean a full clean on every loop, so there's a floor)
+                tile_updates = form_number('ghost_tile_updates', int, 1)
+                if tile_updates is not None: state_ref.setdefault('ghost_budget', {})['tile_updates'] = tile_updates
+                screens = form_number('ghost_screens', float, 0.1)
+                if screens is not None: state_ref.setdefault('ghost_budget', {})['screens'] = screens
+
                 trigger_full_refresh()
 
             save_state(state_ref)
@@ -90,23 +129,29 @@ def create_app(state_ref, trigger_full_refresh, trigger_partial_refresh):
 
     @app.route('/media', methods=['POST'])
     def upload_media():
-        """Handles manual photo uploads for Page 3 (The Art Gallery)"""
+        """
+        Handles manual photo uploads for Page 3 (The Art Gallery).
+        The photo is processed in the background and shown when it's ready.
+        """
         if 'image' not in request.files:
             return redirect(url_for('index'))
             
         file = request.files['image']
-        if file.filename != '':
-            temp_path = os.path.join(UPLOAD_DIR, 'temp_upload.jpg')
-            file.save(temp_path)
-            process_upload(temp_path, UPLOAD_DIR)
-            
+        if file.filename == '':
+            return redirect(url_for('index'))
+
+        temp_path = os.path.join(UPLOAD_DIR, f'temp_upload_{time.time_ns()}.jpg')
+        file.save(temp_path)
+
+        def show_photo(_):
             state_ref['has_photo'] = True
             state_ref['active_page'] = 3
             state_ref['active_mode'] = 1
             trigger_full_refresh()
             save_state(state_ref)
-            
-        return redirect(url_for('index'))
+
+        job_id = submit('photo', ingest_upload, temp_path, UPLOAD_DIR, dither_for('dither_photo'), on_done=show_photo)
+        return accepted([job_id])
     
     @app.route('/api/slides/thumb/<slide_id>')
     def serve_thumb(slide_id):
@@ -116,9 +161,9 @@ def create_app(state_ref, trigger_full_refresh, trigger_partial_refresh):
     @app.route('/api/slides', methods=['GET'])
     def list_slides():
         """Returns a list of all pre-processed slides."""
-        # Find all black layers, which represent a valid slide pair
-        search_pattern = os.path.join(SLIDESHOW_DIR, '*_black.bmp')
-        slides = [os.path.basename(f).replace('_black.bmp', '') for f in glob.glob(search_pattern)]
+        # Every packed frame is a finished slide
+        search_pattern = os.path.join(SLIDESHOW_DIR, '*.epd')
+        slides = [os.path.basename(f)[:-len('.epd')] for f in glob.glob(search_pattern)]
         return jsonify({
             "slides": sorted(slides),
             "interval_seconds": state_ref.get('slideshow_interval', 3600)
@@ -126,52 +171,40 @@ def create_app(state_ref, trigger_full_refresh, trigger_partial_refresh):
 
     @app.route('/api/slides/upload', methods=['POST'])
     def upload_slide():
-        """Uploads a new slide, generates a thumbnail, pre-processes it, and saves the pair."""
-        if 'image' not in request.files:
+        """
+        Uploads one or more slides (several 'image' files at once for a batch). Each is turned
+        into its packed frame and thumbnail by the worker pool, in parallel.
+        """
+        files = [f for f in request.files.getlist('image') if f.filename != '']
+        if not files:
             return redirect(url_for('index'))
-            
-        file = request.files['image']
-        if file.filename != '':
-            slide_id = str(int(time.time())) # Unique ID 
-            
-            temp_path = os.path.join(SLIDESHOW_DIR, f'temp_{slide_id}.jpg')
-            file.save(temp_path)
-            
-            # --- NEW: Generate a tiny color thumbnail BEFORE palette processing ---
-            try:
-                img = Image.open(temp_path).convert("RGB")
-                img.thumbnail((160, 96)) # Scaled perfectly to match the 800x480 screen aspect ratio
-                img.save(os.path.join(SLIDESHOW_DIR, f'{slide_id}_thumb.jpg'))
-            except Exception as e:
-                print(f"[-] Error generating thumbnail: {e}")
-            # -------------------------------------------------------------------
-            
-            # Process into e-ink palette
-            process_upload(temp_path, SLIDESHOW_DIR)
-            
-            # Rename processed BMPs
-            os.rename(os.path.join(SLIDESHOW_DIR, 'black_layer.bmp'), os.path.join(SLIDESHOW_DIR, f'{slide_id}_black.bmp'))
-            os.rename(os.path.join(SLIDESHOW_DIR, 'red_layer.bmp'), os.path.join(SLIDESHOW_DIR, f'{slide_id}_red.bmp'))
-            
-            os.remove(temp_path)
-            
+
+        def slide_ready(_):
             if state_ref.get('active_page') == 3 and state_ref.get('active_mode') == 2:
                 state_ref['slideshow_index'] = 0
                 trigger_full_refresh()
-                
             save_state(state_ref)
-            
-        return redirect(url_for('index'))
+
+        job_ids = []
+        batch = int(time.time())
+        for i, file in enumerate(files):
+            slide_id = f"{batch}_{i:03d}" if len(files) > 1 else str(batch) # Unique ID
+            temp_path = os.path.join(SLIDESHOW_DIR, f'temp_{slide_id}.jpg')
+            file.save(temp_path)
+
+            # Process into e-ink palette, with a tiny color thumbnail for the Web UI from the same decode
+            job_ids.append(submit('slide', ingest_upload, temp_path, SLIDESHOW_DIR, dither_for('dither_slideshow'),
+                                  thumbnail=os.path.join(SLIDESHOW_DIR, f'{slide_id}_thumb.jpg'),
+                                  name=f'{slide_id}.epd', on_done=slide_ready))
+        return accepted(job_ids)
 
     @app.route('/api/slides/delete/<slide_id>', methods=['POST'])
     def delete_slide(slide_id):
-        """Deletes a pre-processed slide pair."""
-        path_b = os.path.join(SLIDESHOW_DIR, f'{slide_id}_black.bmp')
-        path_r = os.path.join(SLIDESHOW_DIR, f'{slide_id}_red.bmp')
+        """Deletes a pre-processed slide."""
+        path_f = os.path.join(SLIDESHOW_DIR, f'{slide_id}.epd')
         path_t = os.path.join(SLIDESHOW_DIR, f'{slide_id}_thumb.jpg')
         
-        if os.path.exists(path_b): os.remove(path_b)
-        if os.path.exists(path_r): os.remove(path_r)
+        if os.path.exists(path_f): os.remove(path_f)
         if os.path.exists(path_t): os.remove(path_t)
         
         # Reset index to prevent out-of-bounds errors on the hardware loop
@@ -188,6 +221,14 @@ def create_app(state_ref, trigger_full_refresh, trigger_partial_refresh):
         save_state(state_ref)
         return redirect(url_for('index'))
 
+    @app.route('/api/jobs/<job_id>', methods=['GET'])
+    def job_status(job_id):
+        """Status of a background job: queued, running, done or error."""
+        job = get_job(job_id)
+        if job is None:
+            return jsonify({"error": "Unknown job"}), 404
+        return jsonify(job)
+
     # --- QUOTES ENDPOINTS ---
     @app.route('/api/quotes', methods=['GET'])
     def list_quotes():
@@ -196,7 +237,8 @@ def create_app(state_ref, trigger_full_refresh, trigger_partial_refresh):
         csvs = [os.path.basename(f) for f in glob.glob(os.path.join(QUOTES_DIR, '*.csv'))]
         return jsonify({
             "active_csv": state_ref.get('active_quote_csv', ''),
-            "available_csvs": sorted(csvs)
+            "available_csvs": sorted(csvs),
+            "layout_jobs": precompute_progress()
         })
 
     @app.route('/api/quotes/upload', methods=['POST'])
@@ -208,7 +250,12 @@ def create_app(state_ref, trigger_full_refresh, trigger_partial_refresh):
         if file.filename != '' and file.filename.endswith('.csv'):
             # Secure the filename to prevent path traversal
             filename = secure_filename(file.filename)
-            file.save(os.path.join(QUOTES_DIR, filename))
+            csv_path = os.path.join(QUOTES_DIR, filename)
+            file.save(csv_path)
+
+            # Index it and lay out every quote in the background (progress in /api/quotes),
+            # so showing a quote never has to parse the CSV or fit its text
+            start_precompute(csv_path)
             
             # If no active CSV is set, make this one active automatically
             if not state_ref.get('active_quote_csv'):
@@ -222,7 +269,7 @@ def create_app(state_ref, trigger_full_refresh, trigger_partial_refresh):
         filename = request.form.get('filename')
         if filename:
             state_ref['active_quote_csv'] = filename
-            state_ref['shown_quotes'] = [] # Reset the shown list when switching files!
+            # No reset needed: each CSV's store keeps its own shuffle cursor
             save_state(state_ref)
             
             # If we are currently looking at the quotes page, force a refresh
@@ -237,6 +284,7 @@ def create_app(state_ref, trigger_full_refresh, trigger_partial_refresh):
         path = os.path.join(QUOTES_DIR, safe_name)
         if os.path.exists(path):
             os.remove(path)
+            remove_store(path)
             # If we deleted the active one, clear the state
             if state_ref.get('active_quote_csv') == safe_name:
                 state_ref['active_quote_csv'] = ""
@@ -247,38 +295,38 @@ def create_app(state_ref, trigger_full_refresh, trigger_partial_refresh):
     def api_push_image():
         """
         The dedicated endpoint for Page 1, Mode 3 (Custom B&W API Push).
-        Intercepts the upload, forces 800x480 B&W, and triggers a full-screen partial update.
+        Intercepts the upload, forces 800x480 B&W, and triggers a partial update of whatever changed.
         """
         if state_ref.get('active_page') != 1 or state_ref.get('active_mode') != 3:
             return jsonify({"error": "Device is not currently in API Push mode (Page 1, Mode 3)."}), 403
         
         if request.form.get('retrig', 'false').lower() == 'true':
             print("Triggered retrigg")
-            trigger_partial_refresh((0, 0, 800, 480))
+            trigger_partial_refresh((0, 0, 800, 480), force=True)
             return jsonify({"status" : "success"}), 200
         
         if 'image' not in request.files:
             return jsonify({"error": "No image provided"}), 400
             
         file = request.files['image']
-        current_image_path = os.path.join(UPLOAD_DIR, 'api_current.bmp')
+        current_image_path = os.path.join(UPLOAD_DIR, 'api_current.epd')
         
         # Check if this is the first push before we overwrite the file 
         is_first_push = not os.path.exists(current_image_path)
         
         try:
-            # Force exactly 800x480 B&W format and overwrite the current image directly
-            img = Image.open(file).convert('1').resize((800, 480))
-            img.save(current_image_path, format='BMP')
+            # Force exactly 800x480 B&W format and overwrite the current frame (black plane only)
+            img = open_image(file)[0].convert('1').resize((800, 480))
+            save_layers(current_image_path, img)
         except Exception as e:
             return jsonify({"error": f"Failed to process image: {e}"}), 400
         
         # Check for force_full override OR if it's the very first image
         if request.form.get('force_full', 'false').lower() == 'true' or is_first_push:
-            trigger_full_refresh()
+            trigger_full_refresh(force=True)
             return jsonify({"status": "success", "update_type": "full_refresh"})
             
-        # Tell the main thread to execute a partial update on the ENTIRE 800x480 canvas
+        # Tell the main thread to diff the ENTIRE 800x480 canvas and partially refresh what changed
         full_screen_bbox = (0, 0, 800, 480)
         trigger_partial_refresh(full_screen_bbox)
         
@@ -0,0 +1,58 @@
+import os
+import threading
+from collections import OrderedDict
+from PIL import Image
+
+# Decoded images (icons, pre-baked layers) kept in their final panel-ready mode and size.
+# Entries are validated against the file's mtime, so re-uploading a file replaces its entry.
+MAX_BYTES = 16 * 1024 * 1024  # A full 1-bit layer is 48 KB; leaves plenty of a 512 MB Pi free
+
+_assets = OrderedDict()  # (path, mode, size) -> (mtime_ns, image, nbytes)
+_lock = threading.Lock()
+_total = 0
+stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+def _nbytes(img):
+    if img.mode == "1":
+        return (img.width + 7) // 8 * img.height
+    return img.width * img.height * len(img.getbands())
+
+def get_image(path, mode="1", size=None):
+    """
+    Returns the image at path converted to mode (then resized to size), decoded only once
+    per version of the file. The returned image is shared: paste from it, don't draw on it.
+    Raises OSError like Image.open if the file is missing or unreadable.
+    """
+    global _total
+    mtime = os.stat(path).st_mtime_ns
+    key = (path, mode, size)
+
+    with _lock:
+        entry = _assets.get(key)
+        if entry is not None and entry[0] == mtime:
+            _assets.move_to_end(key)
+            stats["hits"] += 1
+            return entry[1]
+        stats["misses"] += 1
+
+    with Image.open(path) as src:
+        img = src.convert(mode)
+    if size and img.size != tuple(size):
+        img = img.resize(size)
+
+    nbytes = _nbytes(img)
+    with _lock:
+        old = _assets.pop(key, None)
+        if old is not None:
+            _total -= old[2]
+        _assets[key] = (mtime, img, nbytes)
+        _total += nbytes
+        while _total > MAX_BYTES and len(_assets) > 1:
+            _, (_, _, evicted) = _assets.popitem(last=False)
+            _total -= evicted
+            stats["evictions"] += 1
+    return img
+
+def asset_stats():
+    with _lock:
+        return dict(stats, cached=len(_assets), bytes=_total)
@@ -0,0 +1,301 @@
+"""
+Micro-benchmarks for the display pipeline. No hardware needed.
+Usage: uv run bench.py [name ...]   (runs everything when no name is given)
+"""
+import os
+import sys
+import time
+from PIL import Image, ImageDraw, ImageFilter
+
+# Everything that touches the driver runs against the simulated panel
+os.environ['EPD_BACKEND'] = 'sim'
+
+from driver import epdconfig
+from driver.packing import pack_planes
+
+def timeit(fn, repeat=5):
+    """Returns the best wall-clock time of `repeat` runs, in milliseconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+def sample_frame():
+    """An 800x480 frame with some content on both layers."""
+    img_black = Image.new('1', (800, 480), 255)
+    img_red = Image.new('1', (800, 480), 255)
+    draw_black, draw_red = ImageDraw.Draw(img_black), ImageDraw.Draw(img_red)
+    for i in range(0, 800, 40):
+        draw_black.line([(i, 0), (800 - i, 480)], fill=0, width=3)
+    draw_red.ellipse([(250, 90), (550, 390)], fill=0)
+    return img_black, img_red
+
+# --- FRAMEBUFFER PACKING ---
+def legacy_pack(image_black, image_red):
+    """The original getbuffer() + display() path: invert both planes, then invert black back."""
+    planes = []
+    for img in (image_black, image_red):
+        buf = bytearray(img.convert('1').tobytes('raw'))
+        for i in range(len(buf)):
+            buf[i] ^= 0xFF
+        planes.append(buf)
+    for i in range(len(planes[0])):
+        planes[0][i] ^= 0xFF
+    return planes[0], planes[1]
+
+def bench_pack():
+    img_black, img_red = sample_frame()
+    old_black, old_red = legacy_pack(img_black, img_red)
+    new_black, new_red = pack_planes(img_black, img_red)
+    assert bytes(old_black) == new_black and bytes(old_red) == new_red, "packed planes differ"
+
+    old_ms = timeit(lambda: legacy_pack(img_black, img_red))
+    new_ms = timeit(lambda: pack_planes(img_black, img_red))
+    print(f"pack 800x480: per-byte loops {old_ms:.1f} ms | bulk {new_ms:.2f} ms | {old_ms / new_ms:.0f}x")
+
+# --- SPI TRANSACTIONS ---
+def legacy_base_color(epd, color):
+    """The original display_Base_color(): one send_data() per byte."""
+    epd.send_command(0x10)
+    for _ in range(epd.height * epd.width // 8):
+        epd.send_data(color)
+    epd.send_command(0x13)
+    for _ in range(epd.height * epd.width // 8):
+        epd.send_data(~color & 0xFF)
+    epd.send_command(0x12)
+
+def bench_spi():
+    from driver.epd7in5b_V2 import EPD
+
+    sim = epdconfig.implementation
+    time_scale, sim.time_scale = sim.time_scale, 0
+    epd = EPD()
+    img_black, img_red = sample_frame()
+    cases = [
+        ("base color (per byte)", lambda: legacy_base_color(epd, 0xFF)),
+        ("base color (bulk)", lambda: epd.display_Base_color(0xFF)),
+        ("clear", epd.Clear),
+        ("full frame", lambda: epd.display_planes(*pack_planes(img_black, img_red))),
+        ("partial 360x90, first", lambda: epd.display_Partial(bytes(45 * 90), 40, 60, 400, 150)),
+        ("partial 360x90, next", lambda: epd.display_Partial(bytes(45 * 90), 40, 60, 400, 150)),
+    ]
+    for name, run in cases:
+        epd.reset_spi_stats()
+        ms = timeit(run, repeat=1)
+        stats = epd.reset_spi_stats()
+        print(f"spi {name:<24} {stats['transactions']:>6} transactions {stats['bytes']:>6} bytes {ms:8.1f} ms")
+    sim.time_scale = time_scale
+
+# --- END TO END ON THE SIMULATOR ---
+def bench_session():
+    """Pushes a full frame and a few clock-sized partials through the display session.
+    Uses real panel timings unless EPD_SIM_TIME_SCALE says otherwise."""
+    import display
+
+    sim = epdconfig.implementation
+    img_black, img_red = sample_frame()
+    for _ in range(2):
+        display.push_full_update(img_black, img_red)
+    for _ in range(3):
+        display.push_partial_update(img_black, 40, 60, 400, 150)
+
+    # The dashboard clock tick: world clocks box + local time box
+    boxes = [(80, 260, 400, 460), (40, 60, 400, 150)]
+    one_per_box = timeit(lambda: [display.push_partial_update(img_black, *box) for box in boxes], repeat=2)
+    one_cycle = timeit(lambda: display.push_partial_update(img_black, boxes), repeat=2)
+    print(f"session clock tick: one cycle per box {one_per_box:.0f} ms | single cycle {one_cycle:.0f} ms")
+
+    for kind, entry in display.get_display_stats().items():
+        print(f"session {kind:<10} {entry}")
+    print(f"session simulator refreshes: {sim.refreshes}")
+    os.makedirs('cache', exist_ok=True)
+    print(f"session last frame: {sim.save_png(os.path.join('cache', 'bench_frame.png'))}")
+
+# --- CLOCK TICK RENDERING ---
+def legacy_clock(text, font, bbox):
+    """The original tick: draw.text onto a fresh 800x480 layer, then pack it."""
+    img = Image.new('1', (800, 480), 255)
+    ImageDraw.Draw(img).text(bbox[:2], text, font=font, fill=0)
+    return img.tobytes('raw')
+
+def bench_clock():
+    """Glyph-strip rendering of the clock boxes vs full-layer draw.text, checked bit-exact."""
+    from fonts import get_font
+    from glyphs import GlyphSet, render_strip
+    from driver.packing import crop_plane
+
+    cases = [("10:08 AM", get_font(64, "black"), (40, 60, 400, 150)),
+             ("CEST: 06:37 PM", get_font(36, "regular"), (80, 260, 400, 460)),
+             ("Local: 11:59 AM", get_font(24, "regular"), (536, 440, 800, 480))]
+    for text, font, bbox in cases:
+        glyphs = GlyphSet(font)
+        rect, data = render_strip(bbox, [(bbox[0], bbox[1], text, glyphs)])
+        assert data == crop_plane(legacy_clock(text, font, bbox), rect), f"glyph strip differs for {text!r}"
+        old = timeit(lambda: legacy_clock(text, font, bbox), repeat=20)
+        new = timeit(lambda: render_strip(bbox, [(bbox[0], bbox[1], text, glyphs)]), repeat=20)
+        print(f"clock {text!r:<18} draw.text {old:6.2f} ms | glyph strip {new:6.2f} ms ({old / new:4.1f}x, bit-exact)")
+
+# --- SCRATCHPAD MARKDOWN ---
+NOTE = """# Notes for today
+## Errands
+- pick up the **parcel** from the post office before it closes at six
+- call the *plumber* about the kitchen sink
+Plain text with **bold**, *italic* and ***both***, long enough to wrap across the screen at least once."""
+
+def bench_markdown():
+    """Laying out a scratchpad note from scratch vs the cached layout of an unchanged note."""
+    import markdown_layout
+
+    def cold():
+        markdown_layout._layouts.clear()
+        markdown_layout._widths.clear()
+        markdown_layout.layout_markdown(NOTE)
+
+    old = timeit(cold, repeat=10)
+    new = timeit(lambda: markdown_layout.layout_markdown(NOTE), repeat=10)
+    print(f"markdown layout cold {old:6.2f} ms | cached {new * 1000:6.1f} us ({len(markdown_layout.layout_markdown(NOTE))} runs)")
+
+# --- QUOTE FITTING ---
+def legacy_fit(quote_text, draw, max_width=720, max_height=360):
+    """The original fitter: every size from 72 down, re-measuring each growing prefix."""
+    from fonts import get_font, QUOTE_SIZES
+    for size in QUOTE_SIZES:
+        font = get_font(size, "regular")
+        lines, current_line = [], ""
+        for word in quote_text.split():
+            test_line = f"{current_line} {word}".strip()
+            if draw.textlength(test_line, font=font) <= max_width:
+                current_line = test_line
+            else:
+                if current_line:
+                    lines.append(current_line)
+                current_line = word
+        if current_line:
+            lines.append(current_line)
+        if len(lines) * size * 1.2 + size * 1.5 <= max_height:
+            return lines, size
+    return None, None
+
+def synthetic_quotes(count, seed=1):
+    """(id, person, quote) rows from a few words up to paragraphs too long for the screen."""
+    import random
+    rng = random.Random(seed)
+    vocab = ("the a of to and in is it you that life love time world never always people nothing "
+             "everything remember imagination understanding extraordinary happiness courage").split()
+    return [(str(i), "Someone", " ".join(rng.choice(vocab) for _ in range(int(rng.paretovariate(1.2) * 8))))
+            for i in range(count)]
+
+def bench_quotes(count=2000):
+    """Binary-search fitting vs the original linear sweep on a large synthetic CSV, checked identical."""
+    import quote_manager
+    from fonts import preload_fonts
+    preload_fonts()
+    draw = ImageDraw.Draw(Image.new('1', (1, 1)))
+    quotes = synthetic_quotes(count)
+
+    start = time.perf_counter()
+    old = [legacy_fit(text, draw) for _, _, text in quotes]
+    old_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    new = [quote_manager.calculate_best_fit(text, person, quote_id=("bench.csv", qid)) for qid, person, text in quotes]
+    new_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    for qid, person, text in quotes:
+        quote_manager.calculate_best_fit(text, person, quote_id=("bench.csv", qid))
+    cached_ms = (time.perf_counter() - start) * 1000
+
+    same = sum(o == (n[0], n[1].size if n[1] else None) for o, n in zip(old, new))
+    too_long = sum(o[0] is None for o in old)
+    print(f"quotes {count} quotes ({too_long} too long): linear {old_ms:7.1f} ms | binary search {new_ms:6.1f} ms "
+          f"({old_ms / new_ms:4.1f}x) | cached {cached_ms:5.1f} ms | identical {same}/{count}")
+
+# --- PALETTE SPLIT ---
+def legacy_split(img_converted):
+    """The original split: a Python loop over every pixel of the quantized image."""
+    img_black = Image.new('1', img_converted.size, 255)
+    img_red = Image.new('1', img_converted.size, 255)
+    p_black, p_red = img_black.load(), img_red.load()
+    p_old = img_converted.load()
+    for y in range(img_converted.size[1]):
+        for x in range(img_converted.size[0]):
+            if p_old[x, y] == 1: p_black[x, y] = 0
+            elif p_old[x, y] == 2: p_red[x, y] = 0
+    return img_black, img_red
+
+def sample_photo(size=(800, 480)):
+    """A noisy RGB image that quantizes to a mix of all three inks."""
+    return Image.merge('RGB', [Image.effect_noise(size, sigma).convert('L') for sigma in (90, 60, 120)])
+
+def bench_palette():
+    """Whole-image point() LUT split vs the per-pixel loop, checked bit-exact on an upload and an icon."""
+    from palette import quantize, split_layers
+
+    for name, size in (("upload 800x480", (800, 480)), ("icon 100x100", (100, 100))):
+        img_converted = quantize(sample_photo(size))
+        old_layers, new_layers = legacy_split(img_converted), split_layers(img_converted)
+        assert all(o.tobytes() == n.tobytes() for o, n in zip(old_layers, new_layers)), f"palette split differs for {name}"
+        old = timeit(lambda: legacy_split(img_converted), repeat=3)
+        new = timeit(lambda: split_layers(img_converted), repeat=20)
+        print(f"palette {name:<15} per-pixel loop {old:7.1f} ms | point() LUT {new:5.2f} ms ({old / new:5.0f}x, bit-exact)")
+
+def bench_dither():
+    """Time per 800x480 frame for each dithering engine; floyd_steinberg must match the old quantize() call."""
+    from palette import DITHER_ENGINES, quantize, _palette_image
+
+    img = sample_photo().filter(ImageFilter.GaussianBlur(4))  # Smooth tones, where dithering shows
+    assert quantize(img).tobytes() == img.quantize(palette=_palette_image).tobytes(), "default dither changed"
+    for name in DITHER_ENGINES:
+        ms = timeit(lambda: quantize(img, name), repeat=3)
+        inks = {index: count for count, index in quantize(img, name).getcolors()}
+        print(f"dither {name:<16} {ms:8.1f} ms per frame | pixels per ink (white, black, red) {[inks.get(i, 0) for i in range(3)]}")
+
+# --- PACKED FRAMES ---
+def legacy_show(path_b, path_r):
+    """The original slide path: decode both BMPs, paste them onto blank layers, pack them."""
+    img_black, img_red = Image.new('1', (800, 480), 255), Image.new('1', (800, 480), 255)
+    for img, path in ((img_black, path_b), (img_red, path_r)):
+        with Image.open(path) as layer:
+            img.paste(layer.convert('1'), (0, 0))
+    return pack_planes(img_black, img_red)
+
+def bench_frames():
+    """Showing a stored slide: BMP pair vs packed frame, for a dithered photo and flat artwork."""
+    import tempfile
+    from palette import to_layers
+    from frames import save_layers, read_frame
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, (img_black, img_red) in (("photo", to_layers(sample_photo())), ("artwork", sample_frame())):
+            path_b, path_r, path = (os.path.join(tmp, f"{name}{suffix}") for suffix in ("_black.bmp", "_red.bmp", ".epd"))
+            img_black.save(path_b)
+            img_red.save(path_r)
+            save_layers(path, img_black, img_red)
+            frame = read_frame(path)
+            assert (bytes(frame.black), bytes(frame.red)) == legacy_show(path_b, path_r), f"{name} frame differs"
+
+            old = timeit(lambda: legacy_show(path_b, path_r), repeat=20)
+            new = timeit(lambda: read_frame(path), repeat=20)
+            bmp_kb = (os.path.getsize(path_b) + os.path.getsize(path_r)) / 1024
+            print(f"frame {name:<8} BMP pair {old:5.2f} ms, {bmp_kb:5.1f} KB | packed {new:5.3f} ms, "
+                  f"{os.path.getsize(path) / 1024:5.1f} KB ({old / new:3.0f}x, bit-exact)")
+
+BENCHMARKS = {
+    "pack": bench_pack,
+    "spi": bench_spi,
+    "session": bench_session,
+    "clock": bench_clock,
+    "markdown": bench_markdown,
+    "quotes": bench_quotes,
+    "palette": bench_palette,
+    "dither": bench_dither,
+    "frames": bench_frames,
+}
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
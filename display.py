@@ -1,27 +1,23 @@
 import os
 import time
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
+from fonts import get_font, font_stats
+from assets import asset_stats
+from driver.packing import pack_planes, pack_black, align_rect, crop_plane, paste_plane, rect_area, union_rect, contains_rect, dirty_rects, PLANE_SIZE, BLANK_RED
 
 # Attempt to load the EPD driver. 
 # Wrapping in try/except allows you to test the logic on a PC without the hardware attached.
+# Set EPD_BACKEND=sim to run against the simulated panel in driver/epdsim.py instead.
 try:
     from driver.epd7in5b_V2 import EPD
-except ImportError:
+except (ImportError, RuntimeError):
     print("[-] EPD Driver not found. Running in mock mode.")
     EPD = None
 
 # --- HELPERS ---
 def load_fonts():
-    """Loads fonts safely with fallbacks."""
-    try:
-        font_large = ImageFont.truetype("fonts/roboto/Roboto-Black.ttf", 64)
-        font_med = ImageFont.truetype("fonts/roboto/Roboto-Regular.ttf", 36)
-        font_small = ImageFont.truetype("fonts/roboto/Roboto-Regular.ttf", 24)
-        return font_large, font_med, font_small
-    except Exception:
-        print("[-] Custom fonts not found, using default.")
-        default = ImageFont.load_default()
-        return default, default, default
+    """Returns the large/medium/small UI fonts from the shared font cache (default font as fallback)."""
+    return get_font(64, "black"), get_font(36, "regular"), get_font(24, "regular")
 
 def get_sensor_data(dht_sensor):
     """Safely reads the DHT11 sensor and returns a dictionary of raw values."""
@@ -46,6 +42,318 @@ def create_blank_layers(width=800, height=480):
     """Returns a blank Black layer and a blank Red layer (255 = White background)."""
     return Image.new('1', (width, height), 255), Image.new('1', (width, height), 255)
 
+# Static page backgrounds, keyed by page/mode: key -> (config, black layer, red layer)
+_backgrounds = {}
+
+def get_background(key, build, config=None):
+    """
+    Returns fresh copies of the cached static Black/Red layers for a page/mode.
+    build(img_black, img_red) paints the static parts onto blank layers; it only runs again
+    when config (whatever those static parts depend on) changes.
+    """
+    cached = _backgrounds.get(key)
+    if cached is None or cached[0] != config:
+        img_black, img_red = create_blank_layers()
+        build(img_black, img_red)
+        cached = _backgrounds[key] = (config, img_black, img_red)
+        print(f"[*] Rendered static background for {key}")
+    return cached[1].copy(), cached[2].copy()
+
+# --- PANEL SESSION ---
+# Rough cost of a reset + init and of a sleep() before we've measured them ourselves.
+# sleep() alone has a hard-coded 2000ms delay in the driver.
+INIT_COST_ESTIMATE = 0.6
+SLEEP_COST_ESTIMATE = 2.2
+IDLE_SLEEP_SECONDS = 150  # Comfortably longer than the 60s clock tick
+# If more than this share of the screen changed, a partial refresh isn't worth the ghosting
+FULL_REFRESH_AREA = 0.5
+# Full refreshes of frames with no red can use the much shorter init_Fast() waveform.
+# 'auto' does that whenever the panel has no red on it before or after; 'never' always uses init().
+FAST_FULL_POLICIES = ('auto', 'never')
+# Several rects are sent as one bounding window unless that window is this much bigger than they are
+MERGE_RATIO = 1.5
+
+# --- GHOSTING BUDGET ---
+# Partial refreshes leave faint ghosts behind. Instead of cleaning on a fixed timer, we track
+# how much partial refreshing each part of the screen has had since the last full refresh.
+# The screen is split into tiles so one busy spot (like the clock) can use up the budget alone.
+GHOST_TILE_W = 100
+GHOST_TILE_H = 96
+DEFAULT_GHOST_BUDGET = {
+    "tile_updates": 60,  # Partial refreshes touching any single tile
+    "screens": 4.0,      # Total partially refreshed area, in whole screens
+}
+
+class GhostingTracker:
+    """Accumulates partial-update count and area per tile since the last full clean."""
+    def __init__(self, budget=None):
+        self.budget = dict(DEFAULT_GHOST_BUDGET)
+        self.set_budget(budget)
+        self.reset()
+
+    def set_budget(self, budget):
+        if budget:
+            self.budget.update({k: v for k, v in budget.items() if k in DEFAULT_GHOST_BUDGET})
+
+    def reset(self):
+        self.tiles = {}
+        self.partials = 0
+        self.area = 0
+        self.since = time.time()
+
+    def record(self, rects):
+        self.partials += 1
+        for x1, y1, x2, y2 in rects:
+            self.area += (x2 - x1) * (y2 - y1)
+            for ty in range(y1 // GHOST_TILE_H, (y2 - 1) // GHOST_TILE_H + 1):
+                for tx in range(x1 // GHOST_TILE_W, (x2 - 1) // GHOST_TILE_W + 1):
+                    self.tiles[(tx, ty)] = self.tiles.get((tx, ty), 0) + 1
+
+    def screens(self):
+        return self.area / (PLANE_SIZE * 8)
+
+    def over_budget(self):
+        return (max(self.tiles.values(), default=0) >= self.budget["tile_updates"]
+                or self.screens() >= self.budget["screens"])
+
+    def snapshot(self):
+        return {
+            "partials": self.partials,
+            "max_tile_updates": max(self.tiles.values(), default=0),
+            "screens": round(self.screens(), 2),
+            "since": int(self.since),
+            "budget": dict(self.budget),
+        }
+
+class DisplaySession:
+    """
+    Long-lived owner of the panel.
+    Keeps the EPD awake between pushes and only resets/re-inits when the waveform
+    mode (full/fast/partial) has to change, or sleeps once the idle timeout passes.
+    """
+    def __init__(self, idle_timeout=IDLE_SLEEP_SECONDS):
+        self.epd = EPD()
+        self.idle_timeout = idle_timeout
+        self.awake = False
+        self.mode = None
+        self.last_used = 0.0
+        self.init_cost = {}
+        self.sleep_cost = SLEEP_COST_ESTIMATE
+        self.stats = {}
+        # The last frame committed to the panel, as panel-native planes (None = unknown)
+        self.frame_black = None
+        self.frame_red = None
+        # Area where the panel's partial-mode RAM (0x13) is known to match frame_black
+        self.part_ram_box = None
+        self.ghosting = GhostingTracker()
+        self.fast_policy = 'auto'
+
+    def _wake(self, mode):
+        """Brings the panel into the requested mode. Returns True if an init was needed."""
+        if self.awake and self.mode == mode:
+            return False
+
+        start = time.time()
+        if mode == 'full':
+            self.epd.init()
+        elif mode == 'fast':
+            self.epd.init_Fast()
+        elif mode == 'partial':
+            self.epd.init_part()
+            self.epd.partFlag = 1  # Fresh partial session needs its old-data window cleared
+        self.init_cost[mode] = time.time() - start
+
+        self.part_ram_box = None
+        self.awake = True
+        self.mode = mode
+        return True
+
+    def _record(self, update_type, mode, elapsed, did_init):
+        """Tracks wall-clock per update type and what the old init/push/sleep cycle would have cost."""
+        saved = self.sleep_cost
+        if not did_init:
+            saved += self.init_cost.get(mode, INIT_COST_ESTIMATE)
+
+        entry = self.stats.setdefault(update_type, {"count": 0, "seconds": 0.0, "inits": 0, "saved_seconds": 0.0})
+        entry["count"] += 1
+        entry["seconds"] += elapsed
+        entry["inits"] += int(did_init)
+        entry["saved_seconds"] += saved
+        self.last_used = time.time()
+        print(f"[*] {update_type.capitalize()} update took {elapsed:.2f}s (saved ~{saved:.2f}s vs re-init + sleep)")
+
+    def _run(self, update_type, mode, push):
+        start = time.time()
+        try:
+            did_init = self._wake(mode)
+            push()
+        except TimeoutError:
+            # The panel hung on BUSY. Forget its state so the next push does a hardware reset.
+            self.awake = False
+            self.mode = None
+            self.frame_black = self.frame_red = None
+            self.part_ram_box = None
+            raise
+        self._record(update_type, mode, time.time() - start, did_init)
+
+    def full_planes(self, black, red):
+        # An empty red plane is one C-level compare on the packed buffer. The fast waveform
+        # isn't trusted to fully clear red ink, so the panel must not be showing any either.
+        if self.fast_policy == 'auto' and red == BLANK_RED and self.frame_red == BLANK_RED:
+            self._run('fast', 'fast', lambda: self.epd.display_planes(black, red))
+        else:
+            self._run('full', 'full', lambda: self.epd.display_planes(black, red))
+        self.frame_black, self.frame_red = bytearray(black), bytes(red)
+        self.ghosting.reset()
+
+    def partial_rects(self, black, rects):
+        """
+        Refreshes byte-aligned rects of a full black plane in a single panel cycle.
+        Each rect gets its own 0x90 window when the RAM between them is known to match the
+        panel. Otherwise (or when it costs about the same) one bounding window is sent,
+        filled in from the committed frame.
+        """
+        if len(rects) > 1 and self.frame_black is None:
+            # Nothing to fill the gaps between rects with, so fall back to one cycle each
+            for rect in rects:
+                self.partial_rects(black, [rect])
+            return
+
+        union = union_rect(rects)
+        windows = [(crop_plane(black, rect),) + tuple(rect) for rect in rects]
+        ram_valid = (self.awake and self.mode == 'partial' and self.part_ram_box is not None
+                     and contains_rect(self.part_ram_box, union))
+
+        if len(rects) > 1 and ram_valid and rect_area(union) > MERGE_RATIO * sum(rect_area(r) for r in rects):
+            push = lambda: self.epd.display_Partial_multi(windows, *union)
+        else:
+            if len(rects) > 1:
+                composed = bytearray(self.frame_black)
+                for data, *rect in windows:
+                    paste_plane(composed, rect, data)
+                data = crop_plane(composed, union)
+            else:
+                data = windows[0][0]
+            # Pass the absolute x2, y2 coordinates, NOT the calculated width/height!
+            push = lambda: self.epd.display_Partial(data, *union)
+
+        self._run('partial', 'partial', push)
+        self.ghosting.record(rects)
+
+        if not ram_valid:
+            self.part_ram_box = union
+        if self.frame_black is not None:
+            for data, *rect in windows:
+                paste_plane(self.frame_black, rect, data)
+
+    def full(self, image_black, image_red):
+        self.full_planes(*pack_planes(image_black, image_red))
+
+    def partial(self, image_black, rects):
+        self.partial_rects(pack_black(image_black), [align_rect(r) for r in rects])
+
+    def frame(self, image_black, image_red, force_full=False):
+        """
+        Diffs a whole new frame against the committed one and picks the cheapest refresh:
+        nothing, one partial refresh of the dirty rects, or a full refresh.
+        Returns 'none', 'partial' or 'full'.
+        """
+        return self.frame_planes(*pack_planes(image_black, image_red), force_full)
+
+    def frame_planes(self, black, red, force_full=False):
+        """frame() for already packed planes."""
+        if force_full or self.frame_black is None or red != self.frame_red:
+            # Partial refreshes can't draw red, so any red change needs the full waveform
+            self.full_planes(black, red)
+            return 'full'
+
+        rects = dirty_rects(self.frame_black, black)
+        if not rects:
+            print("[*] Frame unchanged. Skipping refresh.")
+            return 'none'
+        if sum(rect_area(r) for r in rects) > FULL_REFRESH_AREA * PLANE_SIZE * 8:
+            self.full_planes(black, red)
+            return 'full'
+
+        self.partial_rects(black, rects)
+        return 'partial'
+
+    def region(self, image_black, bboxes, force=False):
+        """Partial refresh limited to whatever actually changed inside the bboxes. Returns the rects pushed."""
+        return self.region_plane(pack_black(image_black), bboxes, force)
+
+    def patch(self, patches, force=False):
+        """Like region(), but from packed (rect, data) strips laid over the committed frame."""
+        black = bytearray(self.frame_black) if self.frame_black is not None else bytearray(b'\xff' * PLANE_SIZE)
+        for rect, data in patches:
+            paste_plane(black, rect, data)
+        return self.region_plane(black, [rect for rect, _ in patches], force)
+
+    def region_plane(self, black, bboxes, force=False):
+        if force or self.frame_black is None:
+            rects = [align_rect(bbox) for bbox in bboxes]
+        else:
+            rects = [rect for bbox in bboxes for rect in dirty_rects(self.frame_black, black, bbox)]
+
+        if rects:
+            self.partial_rects(black, rects)
+        return rects
+
+    def sleep(self):
+        """Puts the panel into deep sleep. The next push will reset and re-init it."""
+        if not self.awake:
+            return
+        start = time.time()
+        self.epd.sleep()
+        self.sleep_cost = time.time() - start
+        self.awake = False
+        self.mode = None
+
+    def sleep_if_idle(self):
+        if self.awake and time.time() - self.last_used > self.idle_timeout:
+            print(f"[*] Display idle for {self.idle_timeout}s. Putting panel to sleep.")
+            self.sleep()
+
+_session = None
+
+def get_session():
+    """Returns the process-wide display session, creating it on first use."""
+    global _session
+    if _session is None and EPD:
+        _session = DisplaySession()
+    return _session
+
+def sleep_if_idle():
+    """Called from the hardware loop so an unused panel doesn't stay powered up."""
+    if _session:
+        _session.sleep_if_idle()
+
+def get_display_stats():
+    """Per update type: count, total seconds spent, inits performed and estimated seconds saved."""
+    if not _session:
+        return {}
+    stats = dict(_session.stats)
+    stats["busy_wait"] = dict(_session.epd.busy_stats)
+    stats["fonts"] = font_stats()
+    stats["assets"] = asset_stats()
+    return stats
+
+def ghost_clean_due(budget=None):
+    """True once partial updates since the last full refresh have used up the ghosting budget."""
+    if not _session:
+        return False
+    _session.ghosting.set_budget(budget)
+    return _session.ghosting.over_budget()
+
+def set_fast_full_policy(policy):
+    """'auto' uses the fast waveform for black/white-only full refreshes, 'never' disables it."""
+    if _session and policy in FAST_FULL_POLICIES:
+        _session.fast_policy = policy
+
+def get_ghosting():
+    """How much of the ghosting budget has been used, for the state/Web UI."""
+    return _session.ghosting.snapshot() if _session else {}
+
 # --- HARDWARE DISPLAY COMMANDS ---
 def push_full_update(image_black, image_red):
     """Deep flush of the entire screen. Clears ghosting and draws full colors."""
@@ -53,26 +361,69 @@ def push_full_update(image_black, image_red):
         print("[Mock] Full update triggered.")
         return
 
-    epd = EPD()
-    epd.init()
-    epd.display(epd.getbuffer(image_black), epd.getbuffer(image_red))
-    epd.sleep()
+    get_session().full(image_black, image_red)
 
-def push_partial_update(image_black, x1, y1, x2, y2):
+def push_partial_update(image_black, *box):
     """
     Blazing fast update of a specific bounding box.
     STRICTLY Black & White. Red layer is ignored to prevent muddy ghosting.
+    Takes either x1, y1, x2, y2 or a list of (x1, y1, x2, y2) boxes, which are all
+    refreshed in a single panel cycle.
     """
+    rects = box[0] if len(box) == 1 else [box]
     if not EPD:
-        print(f"[Mock] Partial update triggered for box: ({x1}, {y1}, {x2}, {y2})")
+        print(f"[Mock] Partial update triggered for boxes: {rects}")
         return
 
-    # Crop the exact region from the provided black image
-    cropped_region = image_black.crop((x1, y1, x2, y2))
-    
-    epd = EPD()
-    epd.init_part()
-    
-    # FIX: Pass the absolute x2, y2 coordinates, NOT the calculated width/height!
-    epd.display_Partial(get_partial_buffer(cropped_region), x1, y1, x2, y2)
-    epd.sleep()
\ No newline at end of file
+    get_session().partial(image_black, rects)
+
+def push_frame(image_black, image_red, force_full=False):
+    """
+    Pushes a whole new frame, letting the session compare it with what the panel shows
+    and choose between no refresh, a partial refresh of the changed areas, or a full one.
+    """
+    if not EPD:
+        print(f"[Mock] Frame update triggered (force_full={force_full}).")
+        return 'full'
+
+    return get_session().frame(image_black, image_red, force_full)
+
+def push_planes(black, red, force_full=False):
+    """push_frame() for planes already packed with pack_planes(), e.g. a frame prepared ahead of time."""
+    if not EPD:
+        print(f"[Mock] Frame update triggered (force_full={force_full}).")
+        return 'full'
+
+    return get_session().frame_planes(black, red, force_full)
+
+def push_region(image_black, bbox, force=False):
+    """
+    Partial update of bbox (or a list of bboxes, in one panel cycle), shrunk to the
+    pixels that really changed since the last push. STRICTLY Black & White, like push_partial_update.
+    """
+    bboxes = bbox if isinstance(bbox, list) else [bbox]
+    if not EPD:
+        print(f"[Mock] Region update triggered for boxes: {bboxes}")
+        return bboxes
+
+    return get_session().region(image_black, bboxes, force)
+
+def push_region_plane(black, bbox, force=False):
+    """push_region() for an already packed black plane, e.g. one mapped from a frame file."""
+    bboxes = bbox if isinstance(bbox, list) else [bbox]
+    if not EPD:
+        print(f"[Mock] Region update triggered for boxes: {bboxes}")
+        return bboxes
+
+    return get_session().region_plane(black, bboxes, force)
+
+def push_patches(patches, force=False):
+    """
+    push_region() for pre-packed strips, e.g. from glyphs.render_strip(): a list of
+    (byte-aligned rect, data in crop_plane() layout). No full-size images are involved.
+    """
+    if not EPD:
+        print(f"[Mock] Patch update triggered for boxes: {[rect for rect, _ in patches]}")
+        return [rect for rect, _ in patches]
+
+    return get_session().patch(patches, force)
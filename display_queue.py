@@ -0,0 +1,113 @@
+import time
+import threading
+
+# Job kinds, in the order the hardware loop should serve them
+SLIDE_ADVANCE = 'slide_advance'   # Move the slideshow/quote on, then re-render
+FULL_RENDER = 'full_render'       # Re-render the whole page from the current state
+PARTIAL_REGION = 'partial_region' # Re-push part of the API image
+
+def _overlaps(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+def _union(a, b):
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+class DisplayJob:
+    """One pending display command. Repeated requests of the same kind coalesce into it."""
+    def __init__(self, kind, force=False, bboxes=None):
+        self.kind = kind
+        self.force = force
+        self.bboxes = bboxes or []
+        # Set when a FULL_RENDER was folded into this job: the page must be rendered from the current state
+        self.full_render = kind == FULL_RENDER
+        # Time of the oldest request folded into this job, so latency covers the longest wait
+        self.enqueued_at = time.time()
+
+    def merge_bbox(self, bbox):
+        """Adds a region, merging it with any region it overlaps."""
+        bbox = tuple(bbox)
+        merged = True
+        while merged:
+            merged = False
+            for other in self.bboxes:
+                if _overlaps(bbox, other):
+                    self.bboxes.remove(other)
+                    bbox = _union(bbox, other)
+                    merged = True
+                    break
+        self.bboxes.append(bbox)
+
+    def __repr__(self):
+        return f"<{self.kind} force={self.force} bboxes={self.bboxes}>"
+
+class DisplayQueue:
+    """
+    Thread-safe hand-off between Flask/button threads and the hardware loop.
+    Requests are coalesced (the latest frame wins, overlapping regions merge) and the
+    consumer blocks until there is work instead of polling flags.
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._pending = {}
+        self.stats = {}
+
+    def _put(self, kind, force=False, bbox=None):
+        with self._cond:
+            job = self._pending.get(kind)
+            if job is None:
+                job = self._pending[kind] = DisplayJob(kind)
+            job.force = job.force or force
+            if bbox:
+                job.merge_bbox(bbox)
+            self._cond.notify()
+
+    def request_full(self, force=False):
+        self._put(FULL_RENDER, force)
+
+    def request_partial(self, bbox, force=False):
+        self._put(PARTIAL_REGION, force, bbox)
+
+    def request_slide_advance(self):
+        self._put(SLIDE_ADVANCE)
+
+    def get(self, timeout=None):
+        """Blocks until a job is pending (or timeout) and returns the most important one, or None."""
+        with self._cond:
+            if not self._pending:
+                self._cond.wait(timeout)
+            for kind in (SLIDE_ADVANCE, FULL_RENDER, PARTIAL_REGION):
+                job = self._pending.pop(kind, None)
+                if job is None:
+                    continue
+                if kind != PARTIAL_REGION:
+                    # A full render re-reads everything, so it covers any pending render/region too
+                    for covered in (FULL_RENDER, PARTIAL_REGION):
+                        other = self._pending.pop(covered, None)
+                        if other:
+                            job.force = job.force or (other.force and covered == FULL_RENDER)
+                            job.full_render = job.full_render or covered == FULL_RENDER
+                            job.enqueued_at = min(job.enqueued_at, other.enqueued_at)
+                return job
+            return None
+
+    def requeue(self, job):
+        """Puts back a job the hardware loop couldn't finish, merged with anything requested since."""
+        with self._cond:
+            pending = self._pending.get(job.kind)
+            if pending is not None:
+                job.force = job.force or pending.force
+                job.full_render = job.full_render or pending.full_render
+                for bbox in pending.bboxes:
+                    job.merge_bbox(bbox)
+            self._pending[job.kind] = job
+            self._cond.notify()
+
+    def complete(self, job):
+        """Records enqueue-to-panel latency once the hardware loop has pushed the job."""
+        latency = time.time() - job.enqueued_at
+        entry = self.stats.setdefault(job.kind, {"count": 0, "total_s": 0.0, "max_s": 0.0, "last_s": 0.0})
+        entry["count"] += 1
+        entry["total_s"] += latency
+        entry["max_s"] = max(entry["max_s"], latency)
+        entry["last_s"] = latency
+        print(f"[*] {job.kind} job on the panel {latency:.2f}s after it was requested")
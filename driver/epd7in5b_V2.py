@@ -28,15 +28,35 @@
 #
 
 
+import time
 import logging
 from . import epdconfig
+from .packing import INVERT_TABLE, to_1bit
 
 # Display resolution
 EPD_WIDTH       = 800
 EPD_HEIGHT      = 480
 
+# A full 3-colour refresh takes ~16s, so anything past this means the panel is stuck
+BUSY_TIMEOUT_S  = 40
+BUSY_POLL_MS    = 10
+BUSY_SETTLE_MS  = 20
+
 logger = logging.getLogger(__name__)
 
+# Preallocated fill frames, keyed by (byte value, length), shared by every EPD instance
+_fill_cache = {}
+
+def fill_bytes(value, length):
+    """Returns a cached `length`-byte buffer of `value` for bulk fills."""
+    key = (value & 0xFF, length)
+    if key not in _fill_cache:
+        _fill_cache[key] = bytes([key[0]]) * length
+    return _fill_cache[key]
+
+class EPDBusyTimeout(TimeoutError):
+    """The panel never released BUSY. Usually a wiring fault or a hung controller."""
+
 class EPD:
     def __init__(self):
         self.reset_pin = epdconfig.RST_PIN
@@ -46,6 +66,9 @@ class EPD:
         self.width = EPD_WIDTH
         self.height = EPD_HEIGHT
         self.partFlag=1
+        self.busy_timeout = BUSY_TIMEOUT_S
+        self.busy_stats = {"count": 0, "total_s": 0.0, "max_s": 0.0, "last_s": 0.0}
+        self.spi_stats = {"transactions": 0, "bytes": 0}
 
     # Hardware reset
     def reset(self):
@@ -57,32 +80,64 @@ class EPD:
         epdconfig.delay_ms(200)   
 
     def send_command(self, command):
+        self._count_spi(1)
         epdconfig.digital_write(self.dc_pin, 0)
         epdconfig.digital_write(self.cs_pin, 0)
         epdconfig.spi_writebyte([command])
         epdconfig.digital_write(self.cs_pin, 1)
 
     def send_data(self, data):
+        self._count_spi(1)
         epdconfig.digital_write(self.dc_pin, 1)
         epdconfig.digital_write(self.cs_pin, 0)
         epdconfig.spi_writebyte([data])
         epdconfig.digital_write(self.cs_pin, 1)
     
     def send_data2(self, data): #faster
+        self._count_spi(len(data))
         epdconfig.digital_write(self.dc_pin, 1)
         epdconfig.digital_write(self.cs_pin, 0)
         epdconfig.spi_writebyte2(data)
         epdconfig.digital_write(self.cs_pin, 1)
 
-    def ReadBusy(self):
+    def _count_spi(self, nbytes):
+        self.spi_stats["transactions"] += 1
+        self.spi_stats["bytes"] += nbytes
+
+    def reset_spi_stats(self):
+        """Returns the SPI counters since the last reset (e.g. for one frame) and zeroes them."""
+        stats = self.spi_stats
+        self.spi_stats = {"transactions": 0, "bytes": 0}
+        return stats
+
+    def ReadBusy(self, timeout=None):
         logger.debug("e-Paper busy")
+        if timeout is None:
+            timeout = self.busy_timeout
+        start = time.monotonic()
+
         self.send_command(0x71)
-        busy = epdconfig.digital_read(self.busy_pin)
-        while(busy == 0):
-            self.send_command(0x71)
-            busy = epdconfig.digital_read(self.busy_pin)
-        epdconfig.delay_ms(200)
-        logger.debug("e-Paper busy release")
+        if hasattr(epdconfig, 'wait_busy'):
+            # Sleep on the BUSY pin edge instead of hammering SPI with 0x71
+            idle = epdconfig.wait_busy(timeout)
+        else:
+            idle = epdconfig.digital_read(self.busy_pin) != 0
+            while not idle and time.monotonic() - start < timeout:
+                epdconfig.delay_ms(BUSY_POLL_MS)
+                self.send_command(0x71)
+                idle = epdconfig.digital_read(self.busy_pin) != 0
+
+        elapsed = time.monotonic() - start
+        stats = self.busy_stats
+        stats["count"] += 1
+        stats["total_s"] += elapsed
+        stats["max_s"] = max(stats["max_s"], elapsed)
+        stats["last_s"] = elapsed
+
+        if not idle:
+            raise EPDBusyTimeout("e-Paper still busy after %.1fs" % elapsed)
+        epdconfig.delay_ms(BUSY_SETTLE_MS)
+        logger.debug("e-Paper busy release (%.3fs)", elapsed)
         
     def init(self):
         if (epdconfig.module_init() != 0):
@@ -185,34 +240,26 @@ class EPD:
         return 0
 
     def getbuffer(self, image):
-        img = image
-        imwidth, imheight = img.size
-        if(imwidth == self.width and imheight == self.height):
-            img = img.convert('1')
-        elif(imwidth == self.height and imheight == self.width):
-            # image has correct dimensions, but needs to be rotated
-            img = img.rotate(90, expand=True).convert('1')
-        else:
-            logger.warning("Wrong image dimensions: must be " + str(self.width) + "x" + str(self.height))
+        img = to_1bit(image, self.width, self.height)
+        if img is None:
             # return a blank buffer
             return [0x00] * (int(self.width/8) * self.height)
 
-        buf = bytearray(img.tobytes('raw'))
         # The bytes need to be inverted, because in the PIL world 0=black and 1=white, but
         # in the e-paper world 0=white and 1=black.
-        for i in range(len(buf)):
-            buf[i] ^= 0xFF
-        return buf
+        return bytearray(img.tobytes('raw').translate(INVERT_TABLE))
 
     def display(self, imageblack, imagered):
-        self.send_command(0x10)
         # The black bytes need to be inverted back from what getbuffer did
-        for i in range(len(imageblack)):
-            imageblack[i] ^= 0xFF
-        self.send_data2(imageblack)
+        self.display_planes(bytes(imageblack).translate(INVERT_TABLE), imagered)
+
+    def display_planes(self, black_plane, red_plane):
+        """Pushes already panel-native planes (see packing.pack_planes) with no conversion."""
+        self.send_command(0x10)
+        self.send_data2(black_plane)
 
         self.send_command(0x13)
-        self.send_data2(imagered)
+        self.send_data2(red_plane)
         
         self.send_command(0x12)
         epdconfig.delay_ms(100)
@@ -225,14 +272,10 @@ class EPD:
             Width = self.width // 8 +1
         Height = self.height
         self.send_command(0x10)   #Write Black and White image to RAM
-        for j in range(Height):
-            for i in range(Width):
-                self.send_data(color)
+        self.send_data2(fill_bytes(color, Width * Height))
                 
         self.send_command(0x13)  #Write Black and White image to RAM
-        for j in range(Height):
-            for i in range(Width):
-                self.send_data(~color)
+        self.send_data2(fill_bytes(~color, Width * Height))
 
         self.send_command(0x12)
         epdconfig.delay_ms(100)
@@ -257,42 +300,60 @@ class EPD:
         # self.send_data(0x07)
 
         self.send_command(0x91)		#This command makes the display enter partial mode
-        self.send_command(0x90)		#resolution setting
-        self.send_data (Xstart//256)
-        self.send_data (Xstart%256)   #x-start    
+        self._set_partial_window(Xstart, Ystart, Xend, Yend)
 
-        self.send_data ((Xend-1)//256)		
-        self.send_data ((Xend-1)%256)  #x-end	
+        if self.partFlag == 1:
+            self.partFlag = 0
+            self.send_command(0x10)
+            self.send_data2(fill_bytes(0xff, Width * Height))
 
-        self.send_data (Ystart//256)  #
-        self.send_data (Ystart%256)   #y-start    
+        self.send_command(0x13)   #Write Black and White image to RAM
+        self.send_data2(Image)
 
-        self.send_data ((Yend-1)//256)		
-        self.send_data ((Yend-1)%256)  #y-end
-        self.send_data (0x01)
+        self.send_command(0x12)
+        epdconfig.delay_ms(100)
+        self.ReadBusy()
 
+    def display_Partial_multi(self, windows, Xstart, Ystart, Xend, Yend):
+        """
+        Loads several byte-aligned windows [(buf, x1, y1, x2, y2), ...] into RAM through
+        successive 0x90 writes, then refreshes the (Xstart, Ystart, Xend, Yend) area with a
+        single 0x12. The refresh area must cover every window, and RAM between the windows
+        must already hold what the panel shows.
+        """
+        self.send_command(0x91)		#This command makes the display enter partial mode
         if self.partFlag == 1:
             self.partFlag = 0
+            self._set_partial_window(Xstart, Ystart, Xend, Yend)
             self.send_command(0x10)
-            for j in range(Height):
-                    for i in range(Width):
-                        self.send_data(0xff)
+            self.send_data2(fill_bytes(0xff, (Xend - Xstart) // 8 * (Yend - Ystart)))
 
-        self.send_command(0x13)   #Write Black and White image to RAM
-        self.send_data2(Image)
+        for buf, x1, y1, x2, y2 in windows:
+            self._set_partial_window(x1, y1, x2, y2)
+            self.send_command(0x13)   #Write Black and White image to RAM
+            self.send_data2(buf)
 
+        self._set_partial_window(Xstart, Ystart, Xend, Yend)
         self.send_command(0x12)
         epdconfig.delay_ms(100)
         self.ReadBusy()
+
+    def _set_partial_window(self, Xstart, Ystart, Xend, Yend):
+        self.send_command(0x90)		#resolution setting
+        self.send_data2(bytes([
+            Xstart//256, Xstart%256,            #x-start
+            (Xend-1)//256, (Xend-1)%256,        #x-end
+            Ystart//256, Ystart%256,            #y-start
+            (Yend-1)//256, (Yend-1)%256,        #y-end
+            0x01]))
         
     def Clear(self):
-        buf = [0x00] * (int(self.width/8) * self.height)
-        buf2 = [0xff] * (int(self.width/8) * self.height)
+        size = int(self.width/8) * self.height
         self.send_command(0x10)
-        self.send_data2(buf2)
+        self.send_data2(fill_bytes(0xff, size))
             
         self.send_command(0x13)
-        self.send_data2(buf)
+        self.send_data2(fill_bytes(0x00, size))
                 
         self.send_command(0x12)
         epdconfig.delay_ms(100)
@@ -98,6 +98,11 @@ class RaspberryPi:
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
+    def wait_busy(self, timeout=None):
+        # BUSY is low while the panel works; the Button reads high as "pressed".
+        # Blocks on the edge instead of polling. Returns False if it timed out.
+        return self.GPIO_BUSY_PIN.wait_for_press(timeout)
+
     def spi_writebyte(self, data):
         self.SPI.writebytes(data)
 
@@ -309,7 +314,10 @@ output, _ = process.communicate()
 if sys.version_info[0] == 2:
     output = output.decode(sys.stdout.encoding)
 
-if "Raspberry" in output:
+if os.environ.get('EPD_BACKEND', '').lower() == 'sim':
+    from .epdsim import Simulator
+    implementation = Simulator()
+elif "Raspberry" in output:
     implementation = RaspberryPi()
 elif os.path.exists('/sys/bus/platform/drivers/gpio-x3'):
     implementation = SunriseX3()
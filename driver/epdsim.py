@@ -0,0 +1,210 @@
+# Hardware-free stand-in for epdconfig, so the whole render -> SPI path runs on a PC.
+#
+# Select it with EPD_BACKEND=sim. It implements the same interface as the board classes
+# in epdconfig (digital_write/read, spi_writebyte/2, delay_ms, module_init/exit, wait_busy),
+# decodes the command stream the 7.5" V2 driver sends into an 800x480 B/W/R framebuffer
+# and holds BUSY low for as long as the real panel would.
+#
+# Environment knobs:
+#   EPD_SIM_TIME_SCALE  multiplies every emulated delay (1 = real time, 0 = instant)
+#   EPD_SIM_DUMP_DIR    if set, every refresh is saved there as frame_NNNN.png
+
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+WIDTH = 800
+HEIGHT = 480
+ROW_BYTES = WIDTH // 8
+
+# How long the panel holds BUSY, in seconds (datasheet / measured on a Pi Zero)
+FULL_REFRESH_S = 16.0
+FAST_REFRESH_S = 5.5
+PARTIAL_REFRESH_S = 0.9
+POWER_ON_S = 0.08
+POWER_OFF_S = 0.03
+SPI_HZ = 4000000
+
+class Simulator:
+    # Pin definition (same numbers as the Raspberry Pi HAT)
+    RST_PIN  = 17
+    DC_PIN   = 25
+    CS_PIN   = 8
+    BUSY_PIN = 24
+    PWR_PIN  = 18
+
+    def __init__(self, time_scale=None, dump_dir=None):
+        if time_scale is None:
+            time_scale = float(os.environ.get('EPD_SIM_TIME_SCALE', '1'))
+        self.time_scale = time_scale
+        self.dump_dir = dump_dir if dump_dir is not None else os.environ.get('EPD_SIM_DUMP_DIR')
+
+        # Controller RAM (0x10 = black/white "old", 0x13 = red or "new" in partial mode)
+        self.ram_bw = bytearray(b'\xff' * (ROW_BYTES * HEIGHT))
+        self.ram_red = bytearray(ROW_BYTES * HEIGHT)
+        # What the panel is actually showing: bw 1 = white, red 1 = red
+        self.frame_bw = bytearray(b'\xff' * (ROW_BYTES * HEIGHT))
+        self.frame_red = bytearray(ROW_BYTES * HEIGHT)
+
+        self.dc = 0
+        self.command = None
+        self.params = bytearray()
+        self.cursor = 0
+        self.psr = 0x0F
+        self.e5 = None
+        self.partial = False
+        self.window = (0, 0, WIDTH, HEIGHT)
+        self.asleep = False
+        self.busy_until = 0.0
+        self.frames = 0
+        self.refreshes = {"full": 0, "fast": 0, "partial": 0}
+
+    # --- epdconfig interface ---
+    def digital_write(self, pin, value):
+        if pin == self.DC_PIN:
+            self.dc = value
+        elif pin == self.RST_PIN and value == 0:
+            self._hardware_reset()
+
+    def digital_read(self, pin):
+        if pin == self.BUSY_PIN:
+            return 0 if time.monotonic() < self.busy_until else 1
+        return 0
+
+    def delay_ms(self, delaytime):
+        self._sleep(delaytime / 1000.0)
+
+    def wait_busy(self, timeout=None):
+        remaining = self.busy_until - time.monotonic()
+        if timeout is not None and remaining > timeout:
+            time.sleep(timeout)
+            return False
+        if remaining > 0:
+            time.sleep(remaining)
+        return True
+
+    def spi_writebyte(self, data):
+        self._write(data)
+
+    def spi_writebyte2(self, data):
+        self._write(data)
+
+    def module_init(self, cleanup=False):
+        return 0
+
+    def module_exit(self, cleanup=False):
+        logger.debug("spi end")
+
+    # --- Frame access ---
+    def get_frame_image(self):
+        """Returns what the panel currently shows as an RGB PIL image."""
+        from PIL import Image
+        black = Image.frombytes('1', (WIDTH, HEIGHT), bytes(self.frame_bw))
+        red = Image.frombytes('1', (WIDTH, HEIGHT), bytes(self.frame_red))
+        img = Image.new('RGB', (WIDTH, HEIGHT), (255, 255, 255))
+        img.paste((0, 0, 0), mask=black.point(lambda p: 255 - p))
+        img.paste((255, 0, 0), mask=red)
+        return img
+
+    def save_png(self, path):
+        self.get_frame_image().save(path)
+        return path
+
+    # --- Internals ---
+    def _sleep(self, seconds):
+        if self.time_scale > 0:
+            time.sleep(seconds * self.time_scale)
+
+    def _busy(self, seconds):
+        self.busy_until = time.monotonic() + seconds * self.time_scale
+
+    def _hardware_reset(self):
+        self.asleep = False
+        self.partial = False
+        self.command = None
+        self.e5 = None
+
+    def _write(self, data):
+        if self.asleep:
+            return
+        # Time on the wire at the HAT's 4 MHz clock
+        self._sleep(len(data) * 8 / SPI_HZ)
+        if self.dc == 0:
+            for byte in data:
+                self._on_command(byte)
+        elif self.command in (0x10, 0x13):
+            self._write_ram(data)
+        else:
+            self.params.extend(data)
+            self._on_params()
+
+    def _on_command(self, command):
+        self.command = command
+        self.params = bytearray()
+        self.cursor = 0
+        if command == 0x04:     # Power on
+            self._busy(POWER_ON_S)
+        elif command == 0x02:   # Power off
+            self._busy(POWER_OFF_S)
+        elif command == 0x91:   # Partial in
+            self.partial = True
+        elif command == 0x92:   # Partial out
+            self.partial = False
+            self.window = (0, 0, WIDTH, HEIGHT)
+        elif command == 0x12:   # Display refresh
+            self._refresh()
+
+    def _on_params(self):
+        p = self.params
+        if self.command == 0x00 and len(p) == 1:
+            self.psr = p[0]
+        elif self.command == 0xE5 and len(p) == 1:
+            self.e5 = p[0]
+        elif self.command == 0x07 and len(p) == 1 and p[0] == 0xA5:
+            self.asleep = True
+        elif self.command == 0x90 and len(p) == 9:
+            x1, x2 = (p[0] << 8 | p[1]), (p[2] << 8 | p[3]) + 1
+            y1, y2 = (p[4] << 8 | p[5]), (p[6] << 8 | p[7]) + 1
+            self.window = (x1 // 8 * 8, y1, min(WIDTH, x2), min(HEIGHT, y2))
+
+    def _write_ram(self, data):
+        ram = self.ram_bw if self.command == 0x10 else self.ram_red
+        x1, y1, x2, y2 = self.window if self.partial else (0, 0, WIDTH, HEIGHT)
+        width = (x2 - x1 + 7) // 8
+        data = bytes(data)
+        pos = 0
+        # Copy row by row into the active window, continuing where the last chunk stopped
+        while pos < len(data):
+            row, col = divmod(self.cursor, width)
+            if row >= y2 - y1:
+                break
+            n = min(width - col, len(data) - pos)
+            start = (y1 + row) * ROW_BYTES + x1 // 8 + col
+            ram[start:start + n] = data[pos:pos + n]
+            pos += n
+            self.cursor += n
+
+    def _refresh(self):
+        if self.partial:
+            # KW mode: 0x13 holds the new black/white image, 1 = white. Red is left alone.
+            x1, y1, x2, y2 = self.window
+            a, b = x1 // 8, (x2 + 7) // 8
+            for y in range(y1, y2):
+                row = y * ROW_BYTES
+                self.frame_bw[row + a:row + b] = self.ram_red[row + a:row + b]
+            kind, duration = 'partial', PARTIAL_REFRESH_S
+        else:
+            self.frame_bw[:] = self.ram_bw
+            self.frame_red[:] = self.ram_red
+            # init_Fast() forces the 0x5A temperature LUT, which runs the short waveform
+            kind, duration = ('fast', FAST_REFRESH_S) if self.e5 == 0x5A else ('full', FULL_REFRESH_S)
+
+        self.refreshes[kind] += 1
+        self.frames += 1
+        self._busy(duration)
+        if self.dump_dir:
+            os.makedirs(self.dump_dir, exist_ok=True)
+            self.save_png(os.path.join(self.dump_dir, f"frame_{self.frames:04d}.png"))
+        logger.debug("sim %s refresh #%d", kind, self.frames)
@@ -0,0 +1,120 @@
+# Turns PIL layers into the panel-native bit planes for the 7.5" V2 (B/W/R).
+#
+# PIL '1' images store 1 = white, 0 = black, 8 pixels per byte, MSB first,
+# which is exactly what the panel expects in its black/white RAM (0x10).
+# The red RAM (0x13) wants the opposite: 1 = red, 0 = no ink.
+# Everything here works on whole buffers (bytes.translate / tobytes), never per byte in Python.
+
+import logging
+
+EPD_WIDTH       = 800
+EPD_HEIGHT      = 480
+ROW_BYTES       = EPD_WIDTH // 8
+PLANE_SIZE      = ROW_BYTES * EPD_HEIGHT
+
+# A red plane with no red in it, to compare against
+BLANK_RED       = bytes(PLANE_SIZE)
+
+# Lookup table for bytes.translate that flips every bit of a byte
+INVERT_TABLE = bytes(0xFF - i for i in range(256))
+
+logger = logging.getLogger(__name__)
+
+def to_1bit(image, width=EPD_WIDTH, height=EPD_HEIGHT):
+    """Returns the layer as a '1' image in panel orientation, or None if the size is wrong."""
+    imwidth, imheight = image.size
+    if imwidth == height and imheight == width and (imwidth, imheight) != (width, height):
+        # Correct dimensions, but needs to be rotated
+        image = image.rotate(90, expand=True)
+    elif (imwidth, imheight) != (width, height):
+        logger.warning("Wrong image dimensions: must be " + str(width) + "x" + str(height))
+        return None
+    return image if image.mode == '1' else image.convert('1')
+
+def invert(buf):
+    """Bit-inverts a whole buffer in one C-level pass."""
+    return bytes(buf).translate(INVERT_TABLE)
+
+def pack_black(image):
+    """Black/white plane (0x10): PIL's raw 1-bit data is already panel-native."""
+    img = to_1bit(image)
+    if img is None:
+        return bytes([0xFF]) * PLANE_SIZE
+    return img.tobytes('raw')
+
+def pack_red(image):
+    """Red plane (0x13): black pixels on the PIL layer become set (red) bits."""
+    img = to_1bit(image)
+    if img is None:
+        return BLANK_RED
+    return invert(img.tobytes('raw'))
+
+def pack_planes(image_black, image_red):
+    """Returns (black_plane, red_plane) ready to hand to EPD.display_planes()."""
+    return pack_black(image_black), pack_red(image_red)
+
+# --- Plane regions ---
+# Rects are (x1, y1, x2, y2) in pixels, x2/y2 exclusive. The panel can only address
+# whole bytes horizontally, so x is always widened to a multiple of 8.
+
+def align_rect(rect):
+    """Widens a rect to byte boundaries and clips it to the panel."""
+    x1, y1, x2, y2 = rect
+    return (max(0, x1 // 8 * 8), max(0, y1), min(EPD_WIDTH, (x2 + 7) // 8 * 8), min(EPD_HEIGHT, y2))
+
+def crop_plane(plane, rect):
+    """Returns the bytes of a byte-aligned rect, row by row, as display_Partial expects them."""
+    x1, y1, x2, y2 = rect
+    a, b = x1 // 8, x2 // 8
+    return b''.join(plane[y * ROW_BYTES + a:y * ROW_BYTES + b] for y in range(y1, y2))
+
+def paste_plane(plane, rect, data):
+    """Writes a crop_plane() buffer back into a bytearray plane."""
+    x1, y1, x2, y2 = rect
+    a, width = x1 // 8, (x2 - x1) // 8
+    for i, y in enumerate(range(y1, y2)):
+        plane[y * ROW_BYTES + a:y * ROW_BYTES + a + width] = data[i * width:(i + 1) * width]
+
+def rect_area(rect):
+    return (rect[2] - rect[0]) * (rect[3] - rect[1])
+
+def union_rect(rects):
+    return (min(r[0] for r in rects), min(r[1] for r in rects), max(r[2] for r in rects), max(r[3] for r in rects))
+
+def contains_rect(outer, inner):
+    return outer[0] <= inner[0] and outer[1] <= inner[1] and outer[2] >= inner[2] and outer[3] >= inner[3]
+
+def dirty_rects(old, new, bbox=None, merge_gap=16):
+    """
+    XORs two planes and returns the byte-aligned rects that changed, top to bottom.
+    Consecutive changed rows (allowing up to `merge_gap` clean rows in between) form one rect
+    spanning the leftmost to rightmost changed byte. Rows are compared as whole slices and
+    the changed span comes from a single big-int XOR, so clean rows cost almost nothing.
+    """
+    x1, y1, x2, y2 = align_rect(bbox or (0, 0, EPD_WIDTH, EPD_HEIGHT))
+    a, b = x1 // 8, x2 // 8
+    nbytes = b - a
+
+    rects = []
+    current = None
+    for y in range(y1, y2):
+        row = y * ROW_BYTES
+        old_row, new_row = old[row + a:row + b], new[row + a:row + b]
+        if old_row == new_row:
+            continue
+        diff = int.from_bytes(old_row, 'big') ^ int.from_bytes(new_row, 'big')
+        first = a + nbytes - 1 - (diff.bit_length() - 1) // 8
+        last = a + nbytes - 1 - ((diff & -diff).bit_length() - 1) // 8
+
+        if current and y - current[3] <= merge_gap:
+            current[0] = min(current[0], first)
+            current[2] = max(current[2], last + 1)
+            current[3] = y + 1
+        else:
+            if current:
+                rects.append(current)
+            current = [first, y, last + 1, y + 1]
+    if current:
+        rects.append(current)
+
+    return [(r[0] * 8, r[1], r[2] * 8, r[3]) for r in rects]
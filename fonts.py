@@ -0,0 +1,63 @@
+import os
+import threading
+from collections import OrderedDict
+from PIL import ImageFont
+
+# Every FreeTypeFont in the app comes from here, so each (file, size) is parsed from disk once.
+FONT_DIR = os.path.join("fonts", "roboto")
+VARIANTS = {
+    "regular": "Roboto-Regular.ttf",
+    "black": "Roboto-Black.ttf",
+    "bold": "Roboto-Bold.ttf",
+    "italic": "Roboto-Italic.ttf",
+    "bold_italic": "Roboto-BoldItalic.ttf",
+    "black_italic": "Roboto-BlackItalic.ttf",
+}
+MAX_FONTS = 64  # A loaded face is ~100-200 KB, so this stays well under 16 MB
+
+# Sizes the renderer uses: load_fonts() and the quote fitter's 72..24 sweep (author = size - 12)
+QUOTE_SIZES = range(72, 23, -4)
+PRELOAD = ([("black", 64), ("regular", 36), ("regular", 24)]
+           + [("regular", size) for size in QUOTE_SIZES]
+           + [("black", max(20, size - 12)) for size in QUOTE_SIZES])
+
+_fonts = OrderedDict()
+_lock = threading.Lock()
+stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+def get_font(size, variant="regular", path=None):
+    """Returns a cached FreeTypeFont, falling back to PIL's default font if the file is missing."""
+    if path is None:
+        path = os.path.join(FONT_DIR, VARIANTS.get(variant, VARIANTS["regular"]))
+    key = (path, size, variant)
+
+    with _lock:
+        font = _fonts.get(key)
+        if font is not None:
+            _fonts.move_to_end(key)
+            stats["hits"] += 1
+            return font
+        stats["misses"] += 1
+
+    try:
+        font = ImageFont.truetype(path, size)
+    except Exception:
+        print(f"[-] Font {path} not found, using default.")
+        font = ImageFont.load_default()
+
+    with _lock:
+        _fonts[key] = font
+        while len(_fonts) > MAX_FONTS:
+            _fonts.popitem(last=False)
+            stats["evictions"] += 1
+    return font
+
+def preload_fonts():
+    """Loads every size the renderer uses up front, so the first render doesn't pay for it."""
+    for variant, size in PRELOAD:
+        get_font(size, variant)
+    print(f"[*] Preloaded {len(_fonts)} fonts")
+
+def font_stats():
+    with _lock:
+        return dict(stats, cached=len(_fonts))
@@ -0,0 +1,186 @@
+import os
+import re
+import json
+import mmap
+import struct
+import threading
+from collections import OrderedDict, namedtuple
+from PIL import Image
+from driver.packing import pack_planes, pack_black, invert, EPD_WIDTH, EPD_HEIGHT, PLANE_SIZE, BLANK_RED
+
+# Pre-baked pictures (gallery photo, slides, POTD, API pushes) are stored as packed frames:
+# the two panel-native planes exactly as EPD.display_planes() takes them, so showing one is
+# an mmap and no decoding, pasting or bit-flipping.
+#
+#   header (HEADER) | metadata (UTF-8 JSON) | black plane | red plane
+#
+# A plane is stored PackBits-compressed (flag bit set) only when that at least halves it:
+# flat artwork and empty red planes shrink to almost nothing, while dithered photos stay
+# raw and are handed to the driver straight from the page cache.
+MAGIC = b'EPDF'
+VERSION = 1
+HEADER = struct.Struct('<4sBBHHIII')  # magic, version, flags, width, height, black, red and metadata lengths
+RLE_BLACK, RLE_RED = 1, 2
+MAX_FRAMES = 8  # Mapped frames kept open; their pages belong to the page cache, not the heap
+
+Frame = namedtuple('Frame', 'black red meta')
+
+_frames = OrderedDict()  # path -> ((mtime_ns, inode), frame, layers or None)
+_lock = threading.Lock()
+
+# --- PACKBITS ---
+# Header byte h: 0..127 -> the next h + 1 bytes are literal; 129..255 -> the next byte repeated 257 - h times.
+_RUNS = re.compile(rb'(.)\1{2,}', re.S)
+
+def _literal(out, data):
+    for i in range(0, len(data), 128):
+        chunk = data[i:i + 128]
+        out.append(len(chunk) - 1)
+        out += chunk
+
+def rle_encode(data):
+    """PackBits-compresses a buffer. Runs are found by the regex engine, not a loop per byte."""
+    data = bytes(data)
+    out = bytearray()
+    pos = 0
+    for m in _RUNS.finditer(data):
+        _literal(out, data[pos:m.start()])
+        byte, n = m.group(1), m.end() - m.start()
+        while n >= 2:
+            k = min(n, 128)
+            out.append(257 - k)
+            out += byte
+            n -= k
+        if n:
+            _literal(out, byte)
+        pos = m.end()
+    _literal(out, data[pos:])
+    return bytes(out)
+
+def rle_decode(data, size=PLANE_SIZE):
+    data = bytes(data)
+    out = bytearray()
+    i, n = 0, len(data)
+    while i < n:
+        h = data[i]
+        if h < 128:
+            out += data[i + 1:i + h + 2]
+            i += h + 2
+        else:
+            out += data[i + 1:i + 2] * (257 - h)
+            i += 2
+    if len(out) != size:
+        raise ValueError(f"Corrupt frame plane: {len(out)} bytes instead of {size}")
+    return bytes(out)
+
+# --- FILES ---
+def save_frame(path, black, red, meta=None, compress=True):
+    """Writes packed planes (see packing.pack_planes) as a frame, atomically, so a reader never maps half a file."""
+    flags = 0
+    planes = []
+    for plane, flag in ((black, RLE_BLACK), (red, RLE_RED)):
+        plane = bytes(plane)
+        if compress:
+            packed = rle_encode(plane)
+            if len(packed) * 2 <= len(plane):
+                plane = packed
+                flags |= flag
+        planes.append(plane)
+    meta_bytes = json.dumps(meta or {}).encode('utf-8')
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, flags, EPD_WIDTH, EPD_HEIGHT, len(planes[0]), len(planes[1]), len(meta_bytes)))
+        f.write(meta_bytes)
+        f.write(planes[0])
+        f.write(planes[1])
+    os.replace(tmp_path, path)
+
+def save_layers(path, img_black, img_red=None, meta=None, compress=True):
+    """save_frame() for PIL layers; no red layer means no red."""
+    if img_red is None:
+        black, red = pack_black(img_black), BLANK_RED
+    else:
+        black, red = pack_planes(img_black, img_red)
+    save_frame(path, black, red, meta, compress)
+
+def read_frame(path):
+    """
+    Maps a frame file. Raw planes are memoryviews into the mapping (zero copy); compressed
+    ones are decoded to bytes. Raises ValueError if it isn't a frame this build can show.
+    """
+    with open(path, 'rb') as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapping)
+    if len(view) < HEADER.size:
+        raise ValueError(f"{path} is too short to be a frame")
+    magic, version, flags, width, height, len_black, len_red, len_meta = HEADER.unpack_from(view)
+    if magic != MAGIC or version != VERSION or (width, height) != (EPD_WIDTH, EPD_HEIGHT):
+        raise ValueError(f"{path} is not a version {VERSION} {EPD_WIDTH}x{EPD_HEIGHT} frame")
+    if len(view) != HEADER.size + len_meta + len_black + len_red:
+        raise ValueError(f"{path} is truncated")
+
+    start = HEADER.size + len_meta
+    meta = json.loads(bytes(view[HEADER.size:start])) if len_meta else {}
+    black = view[start:start + len_black]
+    red = view[start + len_black:start + len_black + len_red]
+    black = rle_decode(black) if flags & RLE_BLACK else black
+    red = rle_decode(red) if flags & RLE_RED else red
+    if len(black) != PLANE_SIZE or len(red) != PLANE_SIZE:
+        raise ValueError(f"{path} has planes of the wrong size")
+    return Frame(black, red, meta)
+
+def _entry(path):
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_ino)
+    with _lock:
+        entry = _frames.get(path)
+        if entry is not None and entry[0] == version:
+            _frames.move_to_end(path)
+            return entry
+    entry = [version, read_frame(path), None]
+    with _lock:
+        _frames[path] = entry
+        while len(_frames) > MAX_FRAMES:
+            _frames.popitem(last=False)
+    return entry
+
+def get_frame(path):
+    """The frame at path, mapped once per version of the file. Raises OSError/ValueError like read_frame()."""
+    return _entry(path)[1]
+
+def get_layers(path):
+    """
+    The frame at path as (black, red) '1' layers, for pasting into a page.
+    Shared like assets.get_image(): paste from them, don't draw on them.
+    """
+    entry = _entry(path)
+    if entry[2] is None:
+        frame = entry[1]
+        size = (EPD_WIDTH, EPD_HEIGHT)
+        entry[2] = (Image.frombytes('1', size, bytes(frame.black)), Image.frombytes('1', size, invert(frame.red)))
+    return entry[2]
+
+# --- MIGRATION ---
+def migrate_layers(path_b, path_r, path, meta=None):
+    """
+    Packs an old pair of black/red BMP layers into a frame at path, then deletes them.
+    A missing red layer means no red. Returns True if there was anything to migrate.
+    """
+    if not os.path.exists(path_b):
+        return False
+    try:
+        with Image.open(path_b) as img_black:
+            if os.path.exists(path_r):
+                with Image.open(path_r) as img_red:
+                    save_layers(path, img_black, img_red, meta)
+            else:
+                save_layers(path, img_black, None, meta)
+    except (OSError, ValueError) as e:
+        print(f"[-] Could not migrate {path_b}: {e}")
+        return False
+    for old in (path_b, path_r):
+        if os.path.exists(old):
+            os.remove(old)
+    print(f"[*] Migrated {os.path.basename(path_b)} to {os.path.basename(path)}")
+    return True
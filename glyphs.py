@@ -0,0 +1,80 @@
+from PIL import Image, ImageDraw
+from driver.packing import align_rect
+
+# Small text (clock ticks) drawn without FreeType or full-screen images: every glyph is
+# rasterized once per font into 1-bit rows held as ints (MSB = leftmost pixel, 1 = ink),
+# then OR-ed into a byte-aligned strip that is already in the panel's packed format.
+
+CLOCK_CHARS = "0123456789: APM"
+
+class GlyphSet:
+    """Pre-rasterized glyphs of one font. Characters not preloaded are rasterized on first use."""
+    def __init__(self, font, preload=CLOCK_CHARS):
+        self.font = font
+        self.glyphs = {}
+        self.kerning = {}
+        for ch in preload:
+            self.glyph(ch)
+
+    def glyph(self, ch):
+        """Returns (left, top, width, rows, advance) with left/top relative to the text origin."""
+        g = self.glyphs.get(ch)
+        if g is None:
+            left, top, right, bottom = self.font.getbbox(ch)
+            left = min(0, left)
+            width, height = max(0, right - left), max(0, bottom - top)
+            rows = []
+            if width and height:
+                img = Image.new('1', (width, height), 0)
+                ImageDraw.Draw(img).text((-left, -top), ch, font=self.font, fill=1)
+                raw = img.tobytes()
+                stride = (width + 7) // 8
+                pad = stride * 8 - width
+                rows = [int.from_bytes(raw[i * stride:(i + 1) * stride], 'big') >> pad for i in range(height)]
+            g = self.glyphs[ch] = (left, top, width, rows, self.font.getlength(ch))
+        return g
+
+    def kern(self, a, b):
+        """Pen adjustment between two characters, so blitted text spaces like draw.text()."""
+        k = self.kerning.get((a, b))
+        if k is None:
+            k = self.kerning[(a, b)] = self.font.getlength(a + b) - self.font.getlength(a) - self.font.getlength(b)
+        return k
+
+def render_strip(bbox, items):
+    """
+    Blits text into a white, byte-aligned strip covering bbox.
+    items are (x, y, text, glyphset) in screen coordinates, like draw.text((x, y), text).
+    Returns (rect, data) with data in crop_plane() layout, ready for push_patches().
+    """
+    rect = align_rect(bbox)
+    x1, y1, x2, y2 = rect
+    width = x2 - x1
+    rows = [0] * (y2 - y1)
+
+    for x, y, text, glyphs in items:
+        pen = 0.0
+        prev = None
+        placed = []
+        for ch in text:
+            if prev is not None:
+                pen += glyphs.kern(prev, ch)
+            glyph = glyphs.glyph(ch)
+            placed.append((int(pen + 0.5), glyph))
+            pen += glyph[4]
+            prev = ch
+
+        # Like draw.text(), every glyph is shifted by the leftmost bearing of the whole string
+        x_min = min([0] + [px + g[0] for px, g in placed])
+        for px, (left, top, w, grows, advance) in placed:
+            shift = width - (x - x1 + x_min + px) - w
+            for i, bits in enumerate(grows):
+                r = y + top + i - y1
+                if 0 <= r < len(rows):
+                    rows[r] |= bits << shift if shift >= 0 else bits >> -shift
+
+    # Ink bits -> panel bits (1 = white), clipped to the strip
+    full = (1 << width) - 1
+    nbytes = width // 8
+    data = b''.join(((r & full) ^ full).to_bytes(nbytes, 'big') for r in rows)
+    return rect, data
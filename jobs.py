@@ -0,0 +1,107 @@
+import os
+import time
+import uuid
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Image processing (quantizing, dithering, POTD downloads) runs in a small pool of worker
+# processes, so it never holds the GIL the hardware loop and the web server need.
+# Workers are forked rather than spawned: a spawned worker would re-import main.py and grab
+# the panel's and sensor's pins. start_workers() forks them all before any thread exists.
+# Forking again later would copy whatever locks the running threads hold, so if the pool breaks
+# (a worker killed, e.g. for memory) it is never re-created: jobs fail until the service restarts.
+MAX_WORKERS = min(2, os.cpu_count() or 1)  # A 512 MB Pi can't hold many full-size decodes at once
+MAX_FINISHED = 100  # Finished jobs kept around for /api/jobs/<id>
+
+_pool = None
+_broken = None  # Why the pool stopped, once it has
+_jobs = {}
+_futures = {}
+_lock = threading.Lock()
+
+def get_pool():
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=MAX_WORKERS, mp_context=multiprocessing.get_context('fork'))
+    return _pool
+
+def _retire_pool(reason):
+    """Shuts a broken pool down for good (see above)."""
+    global _broken
+    with _lock:
+        if _broken is not None:
+            return
+        _broken = str(reason)
+    print(f"[-] Image worker pool stopped ({reason}); background jobs will fail until a restart.")
+    # From its own thread: this may be running in the pool's manager thread, which holds the shutdown lock
+    threading.Thread(target=get_pool().shutdown, kwargs={"wait": False, "cancel_futures": True}, daemon=True).start()
+
+def start_workers():
+    """Forks the worker processes now. Call it before starting threads, so no worker copies a held lock."""
+    # The first submit to a fork-based pool launches every worker
+    get_pool().submit(int).result()
+    print(f"[*] Started {MAX_WORKERS} image worker process(es)")
+
+def submit(kind, fn, *args, on_done=None, **kwargs):
+    """
+    Runs fn(*args, **kwargs) in a worker process and returns the job id at once.
+    on_done(result) is called (from a pool thread) when it succeeds.
+    """
+    job_id = uuid.uuid4().hex[:12]
+    job = {"id": job_id, "kind": kind, "state": "queued", "submitted": time.time(), "finished": None, "error": None, "result": None}
+    with _lock:
+        _jobs[job_id] = job
+
+    def finish(state, result=None, error=None):
+        with _lock:
+            job.update(state=state, result=result, error=error, finished=time.time())
+            _futures.pop(job_id, None)
+        print(f"[*] {kind} job {job_id} {job['state']} in {job['finished'] - job['submitted']:.2f}s")
+        _prune()
+
+    def done(future):
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"[-] {kind} job {job_id} failed: {e}")
+            if isinstance(e, BrokenProcessPool):
+                _retire_pool(e)
+            finish("error", error=str(e))
+            return
+        finish("done", result)
+        if on_done is not None:
+            on_done(result)
+
+    if _broken is not None:
+        finish("error", error=f"Image worker pool stopped: {_broken}")
+        return job_id
+    try:
+        future = get_pool().submit(fn, *args, **kwargs)
+    except BrokenProcessPool as e:
+        _retire_pool(e)
+        finish("error", error=str(e))
+        return job_id
+    with _lock:
+        _futures[job_id] = future
+    future.add_done_callback(done)
+    return job_id
+
+def _prune():
+    with _lock:
+        finished = sorted((j for j in _jobs.values() if j["finished"]), key=lambda j: j["finished"])
+        for job in finished[:max(0, len(finished) - MAX_FINISHED)]:
+            del _jobs[job["id"]]
+
+def get_job(job_id):
+    """A copy of the job's status, or None if it's unknown (or long finished)."""
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return None
+        future = _futures.get(job_id)
+        if job["state"] == "queued" and future is not None and future.running():
+            job["state"] = "running"
+        return dict(job)
@@ -5,15 +5,21 @@ from datetime import datetime
 import RPi.GPIO as GPIO
 import board
 import adafruit_dht
+import glob
 from PIL import Image, ImageDraw
-import textwrap
 
 # Import our new modular tools
-from utils import load_state, save_state, register_mdns
-from display import push_full_update, push_partial_update, get_sensor_data, create_blank_layers, load_fonts
+from utils import load_state, save_state, register_mdns, FRAME_NAME
+from display import push_frame, push_planes, push_region_plane, push_patches, get_sensor_data, sleep_if_idle, ghost_clean_due, get_ghosting, set_fast_full_policy
 from app import create_app
-from api_handler import get_world_clocks, get_weather, get_todoist_tasks, get_picture_of_the_day, get_calendar_events
+from api_handler import get_world_clocks, get_weather, get_todoist_tasks, get_picture_of_the_day, get_cached_potd, get_calendar_events, POTD_FRAME
 from quote_manager import get_next_quote
+from fonts import preload_fonts
+from frames import get_frame, migrate_layers
+from palette import DEFAULT_DITHER
+from jobs import submit, get_job, start_workers
+from widgets import Context, Layout, Text, Clock, List, Line, Icon, Picture, Markdown, draft_planes
+from display_queue import DisplayQueue, SLIDE_ADVANCE, PARTIAL_REGION
 
 # --- CONFIGURATION & STATE ---
 os.environ['TZ'] = 'Asia/Kolkata'
@@ -26,30 +32,37 @@ POTD_DIR= f"{UPLOAD_DIR}/potd"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(POTD_DIR, exist_ok=True)
 
-# Remove last api push image
-api_current_path = os.path.join(UPLOAD_DIR, 'api_current.bmp')
-if os.path.exists(api_current_path):
-    try:
-        os.remove(api_current_path)
-        print("[*] Cleared old API push image on startup.")
-    except Exception as e:
-        print(f"[-] Could not clear old API image: {e}")
-
-# Shared state and thread-safe flags
+# Remove last api push image (and one from before frames were packed)
+for api_current_path in (os.path.join(UPLOAD_DIR, 'api_current.epd'), os.path.join(UPLOAD_DIR, 'api_current.bmp')):
+    if os.path.exists(api_current_path):
+        try:
+            os.remove(api_current_path)
+            print("[*] Cleared old API push image on startup.")
+        except Exception as e:
+            print(f"[-] Could not clear old API image: {e}")
+
+def migrate_bmp_layers():
+    """One-time move of pictures saved as black/red BMP pairs into packed frames (see frames.py)."""
+    migrate_layers(os.path.join(UPLOAD_DIR, 'black_layer.bmp'), os.path.join(UPLOAD_DIR, 'red_layer.bmp'), os.path.join(UPLOAD_DIR, FRAME_NAME))
+    migrate_layers(os.path.join(POTD_DIR, 'black_layer.bmp'), os.path.join(POTD_DIR, 'red_layer.bmp'), os.path.join(POTD_DIR, POTD_FRAME))
+    for path_b in glob.glob(os.path.join(UPLOAD_DIR, 'slideshow', '*_black.bmp')):
+        base = path_b[:-len('_black.bmp')]
+        migrate_layers(path_b, base + '_red.bmp', base + '.epd')
+
+migrate_bmp_layers()
+
+# Shared state and the display job queue (coalesces requests, wakes the hardware loop at once)
 state = load_state()
-flag_full_refresh = True
-flag_partial_refresh = False
-partial_bbox = None
+display_queue = DisplayQueue()
+display_queue.request_full()
 
-# Callback functions for Flask to trigger updates on the main hardware thread
-def trigger_full_refresh():
-    global flag_full_refresh
-    flag_full_refresh = True
+# Callback functions for Flask to trigger updates on the main hardware thread.
+# Without force, the display layer diffs against the panel and only refreshes what changed.
+def trigger_full_refresh(force=False):
+    display_queue.request_full(force)
 
-def trigger_partial_refresh(bbox):
-    global flag_partial_refresh, partial_bbox
-    partial_bbox = bbox
-    flag_partial_refresh = True
+def trigger_partial_refresh(bbox, force=False):
+    display_queue.request_partial(bbox, force)
 
 # --- HARDWARE SETUP ---
 try:
@@ -130,7 +143,8 @@ def button_callback(channel):
             print("[*] Manual screen refresh triggered.")
             
     save_state(state)
-    trigger_full_refresh()
+    # The extra button is the manual "clear the ghosting" refresh, so it always flashes the panel
+    trigger_full_refresh(force=(channel == BTN_EXTRA))
 
 def setup_gpio():
     print("[*] Setting up GPIO buttons...", flush=True)
@@ -144,299 +158,366 @@ def setup_gpio():
         print(f"[-] FAILED GPIO Setup: {e}")
 
 # --- DISPLAY RENDERER ---
-def render_current_state(time_str, sensor_data):
-    """Builds the full screen image based on the current state and APIs."""
-    img_black, img_red = create_blank_layers()
-    draw_black, draw_red = ImageDraw.Draw(img_black), ImageDraw.Draw(img_red)
-    font_large, font_med, font_small = load_fonts()
-    
-    page = state.get('active_page', 1)
-    mode = state.get('active_mode', 1)
-
-    if state.get('is_rebooting'):
-        draw_red.text((250, 200), "REBOOTING...", font=font_large, fill=0)
-        draw_black.text((260, 280), "Please wait 60 seconds.", font=font_med, fill=0)
+# Every page is a list of widgets (see widgets.py). Widgets read their data from the named
+# sources below; a source is only evaluated when a widget that depends on it is checked.
+ICON_THERMO = "icons/thermo.png"
+ICON_DROP = "icons/drop.png"
+API_IMAGE_PATH = os.path.join(UPLOAD_DIR, 'api_current.epd')
+MEASURE_DRAW = ImageDraw.Draw(Image.new('1', (1, 1))) # The quote engine only measures text with it
+
+def tz_configs():
+    return [
+        {"name": state.get('tz1_name', 'CEST'), "tz": state.get('tz1_zone', 'Europe/Paris')},
+        {"name": state.get('tz2_name', 'NY'), "tz": state.get('tz2_zone', 'America/New_York')},
+        {"name": state.get('tz3_name', 'TYO'), "tz": state.get('tz3_zone', 'Asia/Tokyo')}
+    ]
+
+def layer_pair(path_b, path_r):
+    """The (black, red) layer paths if both exist, else None."""
+    return (path_b, path_r) if os.path.exists(path_b) and os.path.exists(path_r) else None
+
+def existing(path):
+    return path if os.path.exists(path) else None
+
+def slide_files():
+    # Find all pre-processed slide frames
+    return sorted(glob.glob(os.path.join(UPLOAD_DIR, 'slideshow', '*.epd')))
+
+def slide_at(idx, files=None):
+    """Returns (number of slides, frame path of slide idx or None)."""
+    files = slide_files() if files is None else files
+    if not files:
+        return 0, None
+    return len(files), existing(files[idx])
+
+def current_slide(ctx):
+    """Returns (number of slides, frame path of the current one or None)."""
+    files = slide_files()
+    if not files:
+        return 0, None
+
+    # Ensure our index is safely within bounds
+    idx = state.get('slideshow_index', 0)
+    if idx >= len(files):
+        idx = 0
+        state['slideshow_index'] = 0
+        
+    print(f"[*] Rendering Slide {idx + 1}/{len(files)}: {os.path.basename(files[idx])}")
+    return slide_at(idx, files)
+
+POTD_RETRY_SECONDS = 600
+potd_jobs = {} # source -> id of its latest fetch job
+
+def get_potd(ctx):
+    """
+    Today's picture metadata. Fetching and processing a new one runs in the worker pool, so the
+    hardware loop never waits on it: until it's done the previous picture (if any) stays up,
+    and the page is refreshed when the job finishes.
+    """
+    potd_source = ctx['potd_source']
+    cached = get_cached_potd(potd_source)
+    if cached:
+        return cached
+
+    job = get_job(potd_jobs.get(potd_source))
+    if job is None or (job["finished"] and time.time() - job["finished"] > POTD_RETRY_SECONDS):
+        api_key = state.get('unsplash_api_key', '') if potd_source == 'unsplash' else ''
+        dither = state.get('dither_potd', {}).get(potd_source, DEFAULT_DITHER)
+        potd_jobs[potd_source] = submit('potd', get_picture_of_the_day, source=potd_source, api_key=api_key,
+                                        upload_dir=POTD_DIR, dither=dither, on_done=lambda meta: trigger_full_refresh())
+        job = get_job(potd_jobs[potd_source])
+
+    if job["state"] == "error":
+        return {"error": job["error"]}
+    if job["state"] == "done":
+        return job["result"]
+    return get_cached_potd(potd_source, float('inf')) or {"error": "Fetching today's picture..."}
+
+SOURCES = {
+    # 'time' (the local time string) is passed in by the caller
+    "date": lambda ctx: datetime.now().strftime("%A, %B %d"),
+    "clocks": lambda ctx: get_world_clocks(tz_configs())['additional'],
+    "weather": lambda ctx: get_weather(state.get('openweather_api_key', '')),
+    # The DHT11 can take seconds to answer, so it's only read when a sensor widget is checked
+    "sensor": lambda ctx: get_sensor_data(dht_sensor),
+    "sensor_icons": lambda ctx: os.path.exists(ICON_THERMO) and os.path.exists(ICON_DROP),
+    # Pass our state and a draw object (so the engine can measure pixel text width)
+    "quote": lambda ctx: get_next_quote(state, MEASURE_DRAW),
+    "api_image": lambda ctx: os.path.exists(API_IMAGE_PATH),
+    "tasks": lambda ctx: get_todoist_tasks(state.get('todoist_api_key', '')),
+    "events": lambda ctx: get_calendar_events(state.get('calendar_ical_url', '') or 'https://ics.calendarlabs.com/33/0ff71705/India_Holidays.ics'),
+    "scratchpad": lambda ctx: state.get('scratchpad_text', '') or '# Welcome\nAdd **Markdown** notes via the Web UI!\n\n* Supports lists\n* And headers!',
+    "photo": lambda ctx: existing(os.path.join(UPLOAD_DIR, FRAME_NAME)) if state.get('has_photo') else None,
+    "slide": current_slide,
+    "potd_source": lambda ctx: state.get('potd_source', 'nasa'),
+    "potd": get_potd,
+    "potd_layers": lambda ctx: None if "error" in ctx['potd'] else existing(os.path.join(POTD_DIR, POTD_FRAME)),
+}
+
+def placeholder(dep, show, title, hint, title_layer='red'):
+    """The two-line message shown in the middle of a page that has nothing to show yet."""
+    return Text((150, 200), lambda v: [(150, 200, title, 'large', title_layer), (150, 280, hint, 'med', 'black')] if show(v) else None,
+                bbox=(150, 200, 800, 330), deps=(dep,))
+
+def sensor_ok(sensor_data):
+    return sensor_data is not None and "error" not in sensor_data
+
+def sensor_readings(sensor_data, has_icons):
+    if not sensor_ok(sensor_data):
+        return None
+    if has_icons:
+        # Temp next to the thermometer icon, humidity next to the droplet
+        return [(485, 405, f"{sensor_data['temp']}°C", 'med', 'black'), (635, 405, f"{sensor_data['hum']}%", 'med', 'black')]
+    # Fallback if you haven't downloaded the thermo.png/drop.png files yet
+    return f"T: {sensor_data['temp']}°C   H: {sensor_data['hum']}%"
+
+def weather_stats(weather):
+    if "error" in weather:
+        return None
+    return f"H: {weather['temp_max']}°  L: {weather['temp_min']}°\nFeels like: {weather['feels_like']}°\nWind: {weather['wind_speed']} m/s"
+
+def quote_runs(quote_data):
+    if "error" in quote_data:
+        return [(40, 200, "QUOTE ENGINE ERROR", 'large', 'red'), (40, 280, quote_data["error"], 'med', 'black')]
+    # Draw the quote text in our bounding box, then the author slightly below it in Red
+    y_offset = 120
+    runs = []
+    for line in quote_data["lines"]:
+        runs.append((40, y_offset, line, quote_data["font_quote"], 'black'))
+        y_offset += quote_data["line_height"]
+    runs.append((80, y_offset + 20, f"— {quote_data['author']}", quote_data["font_author"], 'red'))
+    return runs
+
+def task_rows(tasks):
+    rows = []
+    for i, task in enumerate(tasks):
+        layer = 'red' if (task.get('priority') == 4 or task.get('is_overdue')) else 'black'
+        task_text = f"{i+1}. {task['content'][:35]}..." if len(task['content']) > 35 else f"{i+1}. {task['content']}"
+        rows.append([(0, task_text, layer)])
+    return rows
+
+def event_rows(events):
+    return [[(0, f"{event['time']}", 'red'), (180, event['title'][:40] + "..." if len(event['title']) > 40 else event['title'], 'black')]
+            for event in events]
+
+SENSOR_BOX = (450, 375, 800, 460)
+
+LAYOUTS = {
+    'rebooting': Layout('rebooting', [
+        Text((250, 200), "REBOOTING...", 'large', 'red'),
+        Text((260, 280), "Please wait 60 seconds."),
+    ]),
 
     # ==========================================
     # PAGE 1: THE DAILY HUB
     # ==========================================
-    elif page == 1:
-        if mode ==1: # Unified Time & Weather Dashboard
-            # --- LEFT SIDE: TIME & DATE ---
-            # Main local time
-            draw_black.text((40, 60), time_str, font=font_large, fill=0)
-            draw_red.text((40, 150), datetime.now().strftime("%A, %B %d"), font=font_med, fill=0)
-            
-            # Secondary Clocks
-            tz_configs = [
-                {"name": state.get('tz1_name', 'CEST'), "tz": state.get('tz1_zone', 'Europe/Paris')},
-                {"name": state.get('tz2_name', 'NY'), "tz": state.get('tz2_zone', 'America/New_York')},
-                {"name": state.get('tz3_name', 'TYO'), "tz": state.get('tz3_zone', 'Asia/Tokyo')}
-            ]
-            
-            clocks = get_world_clocks(tz_configs)
-            draw_black.text((40, 220), "WORLD CLOCKS", font=font_small, fill=0)
-            y_offset=260
-            for clock in clocks['additional']:
-                draw_black.text((80, y_offset), f"{clock['name'].upper()}: {clock['time']}", font=font_med, fill=0)
-                y_offset+=60
-
-            # --- RIGHT SIDE: WEATHER & SENSORS ---
-            # Draw a subtle dividing line
-            draw_black.line([(420, 40), (420, 440)], fill=0, width=2)
-            
-            weather_key = state.get('openweather_api_key', '')
-            weather = get_weather(weather_key)
-            
-            if "error" in weather:
-                draw_red.text((450, 60), weather["error"], font=font_med, fill=0)
-            else:
-                # Weather Icon
-                paths = weather.get("icon_paths")
-                if paths and os.path.exists(paths["black"]) and os.path.exists(paths["red"]):
-                    weather_icon_black = Image.open(paths["black"])
-                    weather_icon_red = Image.open(paths["red"])
-                    
-                    img_black.paste(weather_icon_black, (450, 60))
-                    img_red.paste(weather_icon_red, (450, 60))
-                
-                # Big Temperature
-                draw_black.text((580, 60), f"{weather['temp']}°C", font=font_large, fill=0)
-                
-                # City & Conditions
-                draw_black.text((450, 160), weather['city'].upper(), font=font_small, fill=0)
-                draw_red.text((450, 200), weather['description'], font=font_med, fill=0)
-                
-                # Extra Weather Stats
-                stats_str = f"H: {weather['temp_max']}°  L: {weather['temp_min']}°\nFeels like: {weather['feels_like']}°\nWind: {weather['wind_speed']} m/s"
-                draw_black.text((450, 260), stats_str, font=font_small, fill=0)
-
-            # --- BOTTOM: DHT11 SENSOR ---
-            if sensor_data is None:
-                draw_black.text((450, 410), "Sensor Not Configured", font=font_med, fill=0)
-            elif "error" in sensor_data:
-                draw_red.text((450, 410), "Sensor Read Error", font=font_med, fill=0)
-            else:
-                draw_black.text((450, 375), "INDOOR SENSOR:", font=font_small, fill=0)
-                # Load your custom icon images
-                try:
-                    icon_thermo = Image.open("icons/thermo.png").convert("1").resize((32, 32))
-                    icon_drop = Image.open("icons/drop.png").convert("1").resize((32, 32))
-                    
-                    # Draw Thermometer Icon and Temp text
-                    img_red.paste(icon_thermo, (450, 410)) # Pasting to img_red makes the icon red!
-                    draw_black.text((485, 405), f"{sensor_data['temp']}°C", font=font_med, fill=0)
-                    
-                    # Draw Droplet Icon and Humidity text
-                    img_black.paste(icon_drop, (600, 410)) 
-                    draw_black.text((635, 405), f"{sensor_data['hum']}%", font=font_med, fill=0)
-                except Exception:
-                    # Fallback if you haven't downloaded the thermo.png/drop.png files yet
-                    draw_black.text((450, 405), f"T: {sensor_data['temp']}°C   H: {sensor_data['hum']}%", font=font_med, fill=0)
-            
-        elif mode == 2: # Daily Quotes
-            draw_red.text((40, 40), "QUOTE OF THE MOMENT", font=font_small, fill=0)
-            
-            # Pass our state and our draw object (so the engine can measure pixel text width)
-            quote_data = get_next_quote(state, draw_black)
-            
-            if "error" in quote_data:
-                draw_red.text((40, 200), "QUOTE ENGINE ERROR", font=font_large, fill=0)
-                draw_black.text((40, 280), quote_data["error"], font=font_med, fill=0)
-            else:
-                # Unpack the layout engine results
-                lines = quote_data["lines"]
-                author = quote_data["author"]
-                font_q = quote_data["font_quote"]
-                font_a = quote_data["font_author"]
-                lh = quote_data["line_height"]
-                
-                # Draw the quote text centered vertically in our bounding box
-                y_offset = 120 
-                for line in lines:
-                    draw_black.text((40, y_offset), line, font=font_q, fill=0)
-                    y_offset += lh
-                    
-                # Draw the author slightly below the quote in Red
-                y_offset += 20
-                draw_red.text((80, y_offset), f"— {author}", font=font_a, fill=0)
-            
-            # Keep a small clock at the very bottom so you don't lose track of time!
-            draw_black.text((536, 440), f"Local: {time_str}", font=font_small, fill=0)
-            
-        elif mode == 3: # Custom API Push (B&W Only)
-            api_img_path = os.path.join(UPLOAD_DIR, 'api_current.bmp')
-            if os.path.exists(api_img_path):
-                api_img = Image.open(api_img_path)
-                img_black.paste(api_img, (0, 0))
-            else:
-                draw_black.text((150, 200), "WAITING FOR API PUSH", font=font_large, fill=0)
-                draw_black.text((150, 280), "POST to /api/push_image", font=font_med, fill=0)
+    # Unified Time & Weather Dashboard
+    (1, 1): Layout((1, 1), [
+        # --- LEFT SIDE: TIME & DATE ---
+        Clock((40, 60), 'large', bbox=(40, 60, 400, 150)),
+        Text((40, 150), lambda date: date, 'med', 'red', bbox=(40, 150, 400, 210), deps=('date',), live=True),
+        # Secondary Clocks
+        Text((40, 220), "WORLD CLOCKS", 'small'),
+        List((80, 260), lambda clocks: [f"{clock['name'].upper()}: {clock['time']}" for clock in clocks], 'med', step=60,
+             bbox=(80, 260, 400, 460), deps=('clocks',), live=True, glyphs=True),
+
+        # --- RIGHT SIDE: WEATHER & SENSORS ---
+        # A subtle dividing line
+        Line([(420, 40), (420, 440)], width=2),
+        Text((450, 60), lambda w: w.get("error"), 'med', 'red', bbox=(450, 60, 800, 110), deps=('weather',)),
+        Picture(lambda w: None if "error" in w or not w.get("icon_paths") else layer_pair(w["icon_paths"]["black"], w["icon_paths"]["red"]),
+                xy=(450, 60), bbox=(450, 60, 550, 160), deps=('weather',)),
+        # Big Temperature
+        Text((580, 60), lambda w: None if "error" in w else f"{w['temp']}°C", 'large', bbox=(580, 60, 800, 150), deps=('weather',)),
+        # City & Conditions
+        Text((450, 160), lambda w: None if "error" in w else w['city'].upper(), 'small', bbox=(450, 160, 800, 200), deps=('weather',)),
+        Text((450, 200), lambda w: None if "error" in w else w['description'], 'med', 'red', bbox=(450, 200, 800, 255), deps=('weather',)),
+        # Extra Weather Stats
+        Text((450, 260), weather_stats, 'small', bbox=(450, 260, 800, 370), deps=('weather',)),
+
+        # --- BOTTOM: DHT11 SENSOR ---
+        Text((450, 410), lambda s: "Sensor Not Configured" if s is None else None, bbox=SENSOR_BOX, deps=('sensor',)),
+        Text((450, 410), lambda s: "Sensor Read Error" if s is not None and "error" in s else None, layer='red', bbox=SENSOR_BOX, deps=('sensor',)),
+        Text((450, 375), lambda s: "INDOOR SENSOR:" if sensor_ok(s) else None, 'small', bbox=SENSOR_BOX, deps=('sensor',)),
+        Icon((450, 410), ICON_THERMO, (32, 32), 'red', bbox=SENSOR_BOX, deps=('sensor',), show=sensor_ok), # Red layer makes the icon red!
+        Icon((600, 410), ICON_DROP, (32, 32), 'black', bbox=SENSOR_BOX, deps=('sensor',), show=sensor_ok),
+        Text((450, 405), sensor_readings, bbox=SENSOR_BOX, deps=('sensor', 'sensor_icons')),
+    ]),
+
+    # Daily Quotes
+    (1, 2): Layout((1, 2), [
+        Text((40, 40), "QUOTE OF THE MOMENT", 'small', 'red'),
+        Text((40, 120), quote_runs, bbox=(0, 100, 800, 480), deps=('quote',)),
+        # Keep a small clock at the very bottom so you don't lose track of time!
+        Clock((536, 440), 'small', bbox=(536, 440, 800, 480), fmt=lambda t: f"Local: {t}"),
+    ]),
+
+    # Custom API Push (B&W Only)
+    (1, 3): Layout((1, 3), [
+        Picture(lambda has_image: API_IMAGE_PATH if has_image else None, deps=('api_image',)),
+        placeholder('api_image', lambda has_image: not has_image, "WAITING FOR API PUSH", "POST to /api/push_image", title_layer='black'),
+    ]),
 
     # ==========================================
     # PAGE 2: PRODUCTIVITY
     # ==========================================
-    elif page == 2:
-        if mode == 1: # Todoist Tasks
-            draw_red.text((40, 40), "TODAY'S TASKS", font=font_large, fill=0)
-            todoist_key = state.get('todoist_api_key', '')
-            tasks = get_todoist_tasks(todoist_key)
-            
-            y_offset = 120
-            for i, task in enumerate(tasks):
-                draw_layer = draw_red if (task.get('priority') == 4 or task.get('is_overdue')) else draw_black
-                task_text = f"{i+1}. {task['content'][:35]}..." if len(task['content']) > 35 else f"{i+1}. {task['content']}"
-                draw_layer.text((40, y_offset), task_text, font=font_med, fill=0)
-                y_offset += 50
-                
-        elif mode == 2: # Calendar Agenda
-            draw_red.text((40, 40), "TODAY'S AGENDA", font=font_large, fill=0)
-            ical_url = state.get('calendar_ical_url', '')
-            if ical_url=='':ical_url='https://ics.calendarlabs.com/33/0ff71705/India_Holidays.ics'
-            events = get_calendar_events(ical_url)
-            
-            y_offset = 120
-            for event in events:
-                draw_red.text((40, y_offset), f"{event['time']}", font=font_med, fill=0)
-                title = event['title'][:40] + "..." if len(event['title']) > 40 else event['title']
-                draw_black.text((220, y_offset), title, font=font_med, fill=0)
-                y_offset += 55
-                
-        elif mode == 3: # Scratchpad Notes (Markdown Supported)
-            # Remove the hardcoded "NOTES" title so the user has full control of the canvas
-            note_text = state.get('scratchpad_text', '')
-            if note_text=='':note_text='# Welcome\nAdd **Markdown** notes via the Web UI!\n\n* Supports lists\n* And headers!'
-            y_offset = 40 # Start higher up since we removed the hardcoded header
-            lines = note_text.split('\n')
-            
-            for line in lines:
-                line = line.strip()
-                
-                # Stop drawing if we are about to fall off the bottom of the screen (480px)
-                if y_offset > 440:
-                    break 
-                    
-                # Handle empty lines (spacing)
-                if not line:
-                    y_offset += 25
-                    continue
-                    
-                # --- H1 HEADER (#) ---
-                if line.startswith('# '):
-                    text = line[2:]
-                    # Draw H1 in bold RED
-                    draw_red.text((40, y_offset), text, font=font_large, fill=0)
-                    y_offset += 70
-                    
-                # --- H2 HEADER (##) ---
-                elif line.startswith('## '):
-                    text = line[3:]
-                    # Draw H2 in bold BLACK
-                    draw_black.text((40, y_offset), text, font=font_large, fill=0)
-                    y_offset += 65
-                    
-                # --- BULLET POINTS (- or *) ---
-                elif line.startswith('- ') or line.startswith('* '):
-                    text = line[2:]
-                    # Draw a red bullet point
-                    draw_red.text((40, y_offset), "•", font=font_med, fill=0)
-                    
-                    # Wrap the text so long bullet points don't go off the right edge
-                    wrapped = textwrap.wrap(text, width=45)
-                    for w in wrapped:
-                        draw_black.text((75, y_offset), w, font=font_med, fill=0)
-                        y_offset += 45
-                        if y_offset > 440: break
-                        
-                # --- STANDARD TEXT ---
-                else:
-                    # Clean up basic bolding syntax (**text**) by just rendering it normally for now
-                    # (To actually change font weight mid-sentence in PIL requires complex bounding box math)
-                    clean_line = line.replace('**', '').replace('__', '')
-                    
-                    # Smart word-wrapping 
-                    wrapped = textwrap.wrap(clean_line, width=50)
-                    for w in wrapped:
-                        draw_black.text((40, y_offset), w, font=font_med, fill=0)
-                        y_offset += 45
-                        if y_offset > 440: break
+    # Todoist Tasks
+    (2, 1): Layout((2, 1), [
+        Text((40, 40), "TODAY'S TASKS", 'large', 'red'),
+        List((40, 120), task_rows, step=50, bbox=(40, 120, 800, 480), deps=('tasks',)),
+    ]),
+
+    # Calendar Agenda
+    (2, 2): Layout((2, 2), [
+        Text((40, 40), "TODAY'S AGENDA", 'large', 'red'),
+        List((40, 120), event_rows, step=55, bbox=(40, 120, 800, 480), deps=('events',)),
+    ]),
+
+    # Scratchpad Notes (Markdown Supported), no title so the user has full control of the canvas
+    (2, 3): Layout((2, 3), [
+        Markdown('scratchpad'),
+    ]),
 
     # ==========================================
     # PAGE 3: THE ART GALLERY
     # ==========================================
-    elif page == 3:
-        if mode ==1: # Single Photo or Local Slideshow
-            path_b = os.path.join(UPLOAD_DIR, 'black_layer.bmp')
-            path_r = os.path.join(UPLOAD_DIR, 'red_layer.bmp')
-            if state.get('has_photo') and os.path.exists(path_b) and os.path.exists(path_r):
-                img_black.paste(Image.open(path_b), (0,0))
-                img_red.paste(Image.open(path_r), (0,0))
-            else:
-                draw_red.text((150, 200), "NO PHOTO UPLOADED", font=font_large, fill=0)
-                draw_black.text((150, 280), "Use Web UI to upload media", font=font_med, fill=0)
-        
-        elif mode == 2: # Local Slideshow (Pre-baked E-ink format)
-            slideshow_dir = os.path.join(UPLOAD_DIR, 'slideshow')
-            
-            # Find all pre-processed black layers
-            import glob
-            search_pattern = os.path.join(slideshow_dir, '*_black.bmp')
-            slide_files = sorted(glob.glob(search_pattern))
-            
-            if slide_files:
-                # Ensure our index is safely within bounds
-                idx = state.get('slideshow_index', 0)
-                if idx >= len(slide_files):
-                    idx = 0
-                    state['slideshow_index'] = 0
-                    
-                path_b = slide_files[idx]
-                path_r = path_b.replace('_black.bmp', '_red.bmp') # Match the pair
-                
-                print(f"[*] Rendering Slide {idx + 1}/{len(slide_files)}: {os.path.basename(path_b)}")
-                
-                if os.path.exists(path_b) and os.path.exists(path_r):
-                    img_black.paste(Image.open(path_b), (0,0))
-                    img_red.paste(Image.open(path_r), (0,0))
-            else:
-                draw_red.text((150, 200), "SLIDESHOW FOLDER EMPTY", font=font_large, fill=0)
-                draw_black.text((150, 280), "Upload images via Web UI", font=font_med, fill=0)
-                
-        elif mode == 3: # Picture of the Day
-            potd_source = state.get('potd_source', 'nasa') 
-            api_key = state.get('unsplash_api_key', '') if potd_source == 'unsplash' else ''
-            
-            potd_meta = get_picture_of_the_day(source=potd_source, api_key=api_key, upload_dir=POTD_DIR)
-            path_b = os.path.join(POTD_DIR, 'black_layer.bmp')
-            path_r = os.path.join(POTD_DIR, 'red_layer.bmp')
-            
-            if "error" not in potd_meta and os.path.exists(path_b) and os.path.exists(path_r):
-                img_black.paste(Image.open(path_b), (0,0))
-                img_red.paste(Image.open(path_r), (0,0))
-                
-                # Draw a white box with black text for the photo credit
-                draw_black.rectangle([(0, 440), (800, 480)], fill=255)
-                draw_black.text((10, 445), f"{potd_meta['title']} - {potd_meta['credit']}", font=font_small, fill=0)
-            else:
-                draw_red.text((150, 200), f"POTD ERROR: {potd_source.upper()}", font=font_large, fill=0)
-                draw_black.text((150, 280), potd_meta.get("error", "Unknown Error"), font=font_med, fill=0)
-
-    # Finally, push the deep refresh
-    push_full_update(img_black, img_red)
+    # Single Photo
+    (3, 1): Layout((3, 1), [
+        Picture(lambda photo: photo, deps=('photo',)),
+        placeholder('photo', lambda photo: photo is None, "NO PHOTO UPLOADED", "Use Web UI to upload media"),
+    ]),
+
+    # Local Slideshow (Pre-baked E-ink format)
+    (3, 2): Layout((3, 2), [
+        Picture(lambda slide: slide[1], deps=('slide',)),
+        placeholder('slide', lambda slide: slide[0] == 0, "SLIDESHOW FOLDER EMPTY", "Upload images via Web UI"),
+    ]),
+
+    # Picture of the Day
+    (3, 3): Layout((3, 3), [
+        Picture(lambda layers: layers, deps=('potd_layers',)),
+        # A white box with black text for the photo credit
+        Text((10, 445), lambda meta, layers: f"{meta['title']} - {meta['credit']}" if layers else None, 'small',
+             bbox=(0, 440, 800, 480), deps=('potd', 'potd_layers'), opaque=True),
+        Text((150, 200), lambda source, meta, layers: None if layers else [
+                 (150, 200, f"POTD ERROR: {source.upper()}", 'large', 'red'),
+                 (150, 280, meta.get("error", "Unknown Error"), 'med', 'black')],
+             bbox=(150, 200, 800, 330), deps=('potd_source', 'potd', 'potd_layers')),
+    ]),
+}
+
+def current_layout():
+    if state.get('is_rebooting'):
+        return LAYOUTS['rebooting']
+    key = (state.get('active_page', 1), state.get('active_mode', 1))
+    if key not in LAYOUTS:
+        LAYOUTS[key] = Layout(key, [])
+    return LAYOUTS[key]
+
+def render_current_state(time_str, force_full=False):
+    """Renders the current page, repainting only widgets whose inputs changed, then pushes it."""
+    # The prefetched frame was drawn over the one this replaces. Keep its value though: a quote
+    # was already taken off the shuffle for it, and prefetch_next() re-drafts it
+    prefetched.update(draft=None, planes=None)
+    black, red, repainted = current_layout().render_planes(Context(SOURCES, time=time_str))
+    print(f"[*] Repainted {len(repainted)} widget(s)")
+
+    # Finally, push it. The display layer decides between no-op, partial and full refresh.
+    push_planes(black, red, force_full)
+
+def update_live_widgets(time_str):
+    """Clock tick: re-checks the current page's live widgets and refreshes only the ones that changed."""
+    layout = current_layout()
+    ctx = Context(SOURCES, time=time_str)
+    changed, patches = layout.tick(ctx)
+    if patches:
+        # Glyph strips straight into the panel's format, no full-size images
+        push_patches(patches)
+    elif changed:
+        # Something live can't be drawn as a strip (e.g. the red date), so go through the frame diff
+        img_black, img_red, _ = layout.render(ctx, changed)
+        push_frame(img_black, img_red)
+    return changed
+
+# --- PREFETCH ---
+# Pages that advance on a timer: the context value that changes, how to get its next one, and
+# what that next one was picked from. The next value is taken once per advance and dropped if what
+# it was picked from changes (slides added or removed, another quote CSV). If the page is rendered
+# some other way only its frame is dropped; clock ticks only get repainted onto it.
+def next_slide():
+    files = slide_files()
+    idx = (state.get('slideshow_index', 0) + 1) % max(1, len(files))
+    return idx, slide_at(idx, files)
+
+def slide_basis():
+    return state.get('slideshow_index', 0), slide_files()
+
+ADVANCING = {
+    (1, 2): ('quote', lambda: (None, get_next_quote(state, MEASURE_DRAW)), lambda: state.get('active_quote_csv', '')),
+    (3, 2): ('slide', next_slide, slide_basis),
+}
+prefetched = {"key": None, "basis": None, "index": None, "value": None, "draft": None, "planes": None}
+
+def drop_prefetched():
+    prefetched.update(basis=None, index=None, value=None, draft=None, planes=None)
+
+def prefetch_next(time_str):
+    """
+    Idle work: renders the current page's next quote/slide and packs it, so when the
+    interval expires advancing costs only the panel refresh. Returns True if it did anything.
+    """
+    layout = current_layout()
+    if layout.key not in ADVANCING or state.get('is_rebooting'):
+        return False
+    name, get_next, get_basis = ADVANCING[layout.key]
+
+    basis = get_basis()
+    if prefetched["key"] != layout.key or prefetched["basis"] != basis:
+        drop_prefetched()
+        prefetched["key"] = layout.key
+    if prefetched["value"] is None:
+        prefetched["index"], prefetched["value"] = get_next()
+        prefetched["basis"] = basis
+    elif prefetched["draft"] is not None and layout.is_current(prefetched["draft"]):
+        return False
+
+    start = time.time()
+    draft = layout.draft(Context(SOURCES, time=time_str, **{name: prefetched["value"]}))
+    prefetched.update(draft=draft, planes=draft_planes(draft))
+    print(f"[*] Prefetched next {name} for {layout.key} in {time.time() - start:.2f}s")
+    return True
+
+def advance_prefetched(time_str, force_full=False):
+    """Pushes the prefetched next frame of the current page. Returns False if there isn't a current one."""
+    layout = current_layout()
+    draft = prefetched["draft"]
+    if (prefetched["key"] != layout.key or draft is None or prefetched["basis"] != ADVANCING[layout.key][2]()
+            or not layout.is_current(draft)):
+        return False
+
+    # Bring the clock on it up to date, if it has one
+    name = ADVANCING[layout.key][0]
+    fresh = layout.refresh(draft, Context(SOURCES, time=time_str, **{name: prefetched["value"]}))
+    planes = prefetched["planes"] if fresh is draft else draft_planes(fresh)
+
+    # Only move the index once the panel has it: a push that times out is requeued, and the
+    # retry must still find the prefetch picked from the index it was picked from
+    push_planes(*planes, force_full)
+    if prefetched["index"] is not None:
+        state['slideshow_index'] = prefetched["index"]
+        save_state(state)
+    layout.commit(fresh)
+    drop_prefetched()
+    print(f"[*] Advanced {layout.key} from the prefetched frame")
+    return True
 
 # --- HARDWARE LOOP ---
 def hardware_loop():
-    global flag_full_refresh, flag_partial_refresh, partial_bbox
-    
     last_drawn_time = ""
-    last_full_refresh_time = time.time()
     last_slide_change_time= time.time()
-    font_large, font_med, font_small = load_fonts()
+    last_data_refresh_time = time.time()
     
     while True:
-        now_str = datetime.now().strftime("%I:%M %p")
-        sensor_data = get_sensor_data(dht_sensor)
-        time_since_full = time.time() - last_full_refresh_time
         time_since_slide = time.time() - last_slide_change_time
 
         is_slideshow_active = (state.get('active_page') == 3 and state.get('active_mode') == 2)
@@ -444,84 +525,79 @@ def hardware_loop():
         
         is_quotes_active = (state.get('active_page') == 1 and state.get('active_mode') == 2)
 
-        if is_slideshow_active and time_since_slide >= slide_interval:
-            print("[*] Auto-advancing slideshow...")
-            state['slideshow_index'] = state.get('slideshow_index', 0) + 1
-            save_state(state)
-            flag_full_refresh = True
+        if (is_slideshow_active or is_quotes_active) and time_since_slide >= slide_interval:
+            display_queue.request_slide_advance()
             last_slide_change_time = time.time()
 
-        if is_quotes_active and time_since_slide >= slide_interval:
-            flag_full_refresh=True
-        
-        # 1. API Push Partial Update (Page 1, Mode 3 B&W Diff)
-        if flag_partial_refresh and partial_bbox:
-            print(f"[*] Executing targeted API partial update for box: {partial_bbox}")
-            flag_partial_refresh = False
-            api_img_path = os.path.join(UPLOAD_DIR, 'api_current.bmp')
-            if os.path.exists(api_img_path):
-                img_black = Image.open(api_img_path)
-                push_partial_update(img_black, *partial_bbox)
-                
-            last_drawn_time = now_str # Prevent the clock from interfering
+        # Re-render now and then so pages without live widgets (tasks, agenda, POTD, the dashboard's
+        # weather) pick up new data. Not forced: if nothing changed the display layer skips the refresh.
+        if time.time() - last_data_refresh_time >= state.get('refresh_interval', 3600):
+            display_queue.request_full()
+            last_data_refresh_time = time.time()
 
-        # 2. Full Refresh (Button presses, page swaps, forced clears, or 1hr timeout)
-        elif flag_full_refresh or time_since_full > 3600:
-            print(f"[*] Dispatching FULL refresh. Page: {state['active_page']} | Mode: {state.get('active_mode', 1)}")
-            render_current_state(now_str, sensor_data)
-            
-            flag_full_refresh = False
-            last_drawn_time = now_str
-            last_full_refresh_time = time.time()
-            
-        # 3. Targeted Clock Partial Update
-        elif state['active_page'] == 1 and state.get('active_mode', 1) == 1 and now_str != last_drawn_time and not flag_full_refresh:
-            print(f"[*] Fast partial update for clock tick: {now_str}")
-            
-            img_black_temp, _ = create_blank_layers()
-            draw_temp = ImageDraw.Draw(img_black_temp)
-
-            tz_configs = [
-                    {"name": state.get('tz1_name', 'CEST'), "tz": state.get('tz1_zone', 'Europe/Paris')},
-                    {"name": state.get('tz2_name', 'NY'), "tz": state.get('tz2_zone', 'America/New_York')},
-                    {"name": state.get('tz3_name', 'TYO'), "tz": state.get('tz3_zone', 'Asia/Tokyo')}
-                ]
-            clocks = get_world_clocks(tz_configs)
-            
-            # The new unified clock bounding box (X1: 40, Y1: 60, X2: 400, Y2: 150)
-            lbbox = (40, 60, 400, 150)
-            tbbox = (80, 260, 400, 460)
-            
-            # Wipe the box clean (fill with 255/White) so the old time is erased
-            draw_temp.rectangle(lbbox, fill=255) 
-            draw_temp.text((40, 60), now_str, font=font_large, fill=0)
-
-            y_offset = 260
-            for clock in clocks['additional']:
-                draw_temp.text((80, y_offset), f"{clock['name'].upper()}: {clock['time']}", font=font_med, fill=0)
-                y_offset += 60
-                
-            push_partial_update(img_black_temp, *tbbox)
-
-            # Push ONLY the specific box to the screen using our absolute coordinates
-            push_partial_update(img_black_temp, *lbbox)
-            last_drawn_time = now_str
-
-        # Local time update on Quotes
-        elif is_quotes_active and now_str != last_drawn_time and not flag_full_refresh:
-            img_black_temp, _ = create_blank_layers()
-            draw_temp = ImageDraw.Draw(img_black_temp)
-            lbbox = (536, 440, 800, 480) 
-            draw_temp.rectangle(lbbox, fill=255)
-            draw_temp.text((536, 440), f"Local: {now_str}", font=font_small, fill=0)
-            push_partial_update(img_black_temp, *lbbox)
-            last_drawn_time = now_str
+        # Sleeps until a job arrives, or at most a second so the clock and timers still tick
+        job = display_queue.get(timeout=1.0)
+        now_str = datetime.now().strftime("%I:%M %p")
+        # Full clean once partial updates have used up the ghosting budget, not on a fixed timer
+        clean_due = ghost_clean_due(state.get('ghost_budget'))
+        set_fast_full_policy(state.get('fast_full_refresh', 'auto'))
         
+        advanced_from = None  # Slide index to go back to if the advance never reaches the panel
+        try:
+            # 1. API Push Partial Update (Page 1, Mode 3 B&W Diff)
+            if job is not None and job.kind == PARTIAL_REGION:
+                print(f"[*] Executing targeted API partial update for boxes: {job.bboxes}")
+                if os.path.exists(API_IMAGE_PATH):
+                    # Its black plane goes straight from the mapped frame to the diff
+                    push_region_plane(get_frame(API_IMAGE_PATH).black, job.bboxes, force=job.force)
+                
+                last_drawn_time = now_str # Prevent the clock from interfering
+
+            # 2. Full Refresh (Button presses, page swaps, slide advances, forced clears, or ghosting budget spent)
+            elif job is not None and job.kind == SLIDE_ADVANCE and not job.full_render and advance_prefetched(now_str, job.force or clean_due):
+                # The next slide/quote was already rendered and packed while idle
+                last_drawn_time = now_str
+
+            elif job is not None or clean_due:
+                if job is not None and job.kind == SLIDE_ADVANCE and is_slideshow_active:
+                    print("[*] Auto-advancing slideshow...")
+                    advanced_from = state.get('slideshow_index', 0)
+                    state['slideshow_index'] = advanced_from + 1
+                    save_state(state)
+                print(f"[*] Dispatching FULL refresh. Page: {state['active_page']} | Mode: {state.get('active_mode', 1)}")
+                render_current_state(now_str, force_full=(job is not None and job.force) or clean_due)
+                last_drawn_time = now_str
             
-        time.sleep(0.2)
+            # 3. Live widgets (clocks) on the current page, refreshed from the layout
+            elif now_str != last_drawn_time and current_layout().live:
+                changed = update_live_widgets(now_str)
+                print(f"[*] Fast partial update for clock tick: {now_str} ({len(changed)} widget(s) changed)")
+                last_drawn_time = now_str
+
+            # Nothing to draw: get the next quote/slide ready, then let the panel fall
+            # asleep once nothing has been pushed for a while
+            elif not prefetch_next(now_str):
+                sleep_if_idle()
+
+            if job is not None:
+                display_queue.complete(job)
+        except TimeoutError as e:
+            # A stuck panel raises instead of hanging us forever. The session resets it on the next push,
+            # which retries the job once we've backed off.
+            print(f"[-] Display error: {e}")
+            if advanced_from is not None:
+                state['slideshow_index'] = advanced_from
+                save_state(state)
+            if job is not None:
+                display_queue.requeue(job)
+            time.sleep(5)
+
+        state['ghosting'] = get_ghosting()
 
 if __name__ == '__main__':
+    start_workers()
     setup_gpio()
+    preload_fonts()
     zc, info = register_mdns()
 
     # Create the Flask App and pass in our state and thread-safe triggers
@@ -0,0 +1,189 @@
+import re
+import hashlib
+from collections import OrderedDict
+from fonts import get_font
+
+# Lays out the scratchpad's Markdown subset into draw runs: # / ## headers, - / * bullets,
+# plain paragraphs, and inline **bold**, *italic* (or __ / _) spans.
+# Wrapping uses real pixel widths from a memoized width table, and finished layouts are
+# cached by the text's hash, so re-rendering an unchanged note is a dict lookup.
+
+TOP = 40  # The page has no hardcoded header, so notes start near the top
+LEFT = 40
+RIGHT = 760
+BULLET_X = 40
+BULLET_TEXT_X = 75
+BOTTOM = 440  # Stop once we are about to fall off the bottom of the screen (480px)
+
+BODY_SIZE = 36
+HEADER_SIZE = 64
+LINE_STEP = {"h1": 70, "h2": 65, "body": 45}
+BLANK_STEP = 25
+
+# (bold, italic) -> font variant, for body text and headers
+VARIANTS = {
+    "body": {(False, False): "regular", (True, False): "bold", (False, True): "italic", (True, True): "bold_italic"},
+    "header": {(False, False): "black", (True, False): "black", (False, True): "black_italic", (True, True): "black_italic"},
+}
+
+# ** and __ toggle bold, * and _ toggle italic (a _ inside a word like snake_case is left alone)
+MARKER = re.compile(r"(\*\*|__|\*|(?<!\w)_|_(?!\w))")
+
+MAX_LAYOUTS = 8
+MAX_WIDTHS = 4096
+
+_layouts = OrderedDict()
+_widths = {}
+stats = {"hits": 0, "misses": 0}
+
+def font_for(kind, style):
+    if kind == "body":
+        return get_font(BODY_SIZE, VARIANTS["body"][style])
+    return get_font(HEADER_SIZE, VARIANTS["header"][style])
+
+def text_width(text, font):
+    """Memoized pixel width of a word or run."""
+    key = (text, font)
+    width = _widths.get(key)
+    if width is None:
+        if len(_widths) >= MAX_WIDTHS:
+            _widths.clear()
+        width = _widths[key] = font.getlength(text)
+    return width
+
+def paired_markers(text):
+    """
+    Start offsets of the emphasis markers that pair up. An opener must have non-space text right
+    after it and its closer (the next same marker) non-space text right before it, so "5 * 3"
+    or a lone "**" stay literal.
+    """
+    paired, openers = set(), {}
+    for m in MARKER.finditer(text):
+        before, after = text[m.start() - 1:m.start()], text[m.end():m.end() + 1]
+        stack = openers.setdefault(m.group(), [])
+        if before and not before.isspace() and stack:
+            paired.update((stack.pop(), m.start()))
+        elif after and not after.isspace():
+            stack.append(m.start())
+    return paired
+
+def parse_spans(text):
+    """Splits inline Markdown into (text, (bold, italic)) spans. Unpaired markers are kept as text."""
+    bold = italic = False
+    paired = paired_markers(text)
+    spans = []
+    pos = 0
+    for m in MARKER.finditer(text):
+        if m.start() not in paired:
+            continue
+        if m.start() > pos:
+            spans.append((text[pos:m.start()], (bold, italic)))
+        if m.group() in ("**", "__"):
+            bold = not bold
+        else:
+            italic = not italic
+        pos = m.end()
+    if pos < len(text):
+        spans.append((text[pos:], (bold, italic)))
+    return spans
+
+def split_words(spans):
+    """Returns words as lists of (text, style) segments; a word can change style midway."""
+    words = [[]]
+    for text, style in spans:
+        for i, piece in enumerate(re.split(r"\s+", text)):
+            if i > 0 and words[-1]:
+                words.append([])
+            if piece:
+                words[-1].append((piece, style))
+    return [w for w in words if w]
+
+def wrap(words, kind, max_width):
+    """Greedy pixel-width wrapping. A word wider than the line gets a line of its own."""
+    lines, current, width = [], [], 0
+    for word in words:
+        w = sum(text_width(text, font_for(kind, style)) for text, style in word)
+        space = text_width(" ", font_for(kind, word[0][1])) if current else 0
+        if current and width + space + w > max_width:
+            lines.append(current)
+            current, width = [word], w
+        else:
+            current.append(word)
+            width += space + w
+    if current:
+        lines.append(current)
+    return lines
+
+def line_runs(line, kind, x, y, layer):
+    """Merges a wrapped line's segments into as few same-font runs as possible."""
+    segments = []
+    for i, word in enumerate(line):
+        if i > 0:
+            segments.append((" ", word[0][1]))
+        segments.extend(word)
+
+    runs = []
+    for text, style in segments:
+        if runs and runs[-1][1] == style:
+            runs[-1][0] += text
+        else:
+            runs.append([text, style])
+
+    out = []
+    for text, style in runs:
+        font = font_for(kind, style)
+        out.append((x, y, text, font, layer))
+        x += text_width(text, font)
+    return out
+
+def build_layout(note_text):
+    runs = []
+    y_offset = TOP
+
+    for line in note_text.split("\n"):
+        line = line.strip()
+
+        if y_offset > BOTTOM:
+            break
+
+        # Empty lines are just spacing
+        if not line:
+            y_offset += BLANK_STEP
+            continue
+
+        x, layer = LEFT, "black"
+        if line.startswith("# "):        # H1 in bold RED
+            kind, step, text, layer = "header", LINE_STEP["h1"], line[2:], "red"
+        elif line.startswith("## "):     # H2 in bold BLACK
+            kind, step, text = "header", LINE_STEP["h2"], line[3:]
+        elif line.startswith("- ") or line.startswith("* "):
+            # A red bullet point, with the text wrapped beside it
+            runs.append((BULLET_X, y_offset, "•", font_for("body", (False, False)), "red"))
+            kind, step, text, x = "body", LINE_STEP["body"], line[2:], BULLET_TEXT_X
+        else:
+            kind, step, text = "body", LINE_STEP["body"], line
+
+        for wrapped in wrap(split_words(parse_spans(text)), kind, RIGHT - x):
+            runs.extend(line_runs(wrapped, kind, x, y_offset, layer))
+            y_offset += step
+            if y_offset > BOTTOM:
+                break
+    return runs
+
+def layout_markdown(note_text):
+    """
+    Returns the note as (x, y, text, font, layer) runs, ready for widgets.Text.
+    Layouts are cached by the text's hash.
+    """
+    key = hashlib.sha1(note_text.encode("utf-8")).hexdigest()
+    runs = _layouts.get(key)
+    if runs is not None:
+        _layouts.move_to_end(key)
+        stats["hits"] += 1
+        return runs
+
+    stats["misses"] += 1
+    runs = _layouts[key] = build_layout(note_text)
+    while len(_layouts) > MAX_LAYOUTS:
+        _layouts.popitem(last=False)
+    return runs
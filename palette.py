@@ -0,0 +1,134 @@
+import time
+from PIL import Image, ImageChops
+
+# The panel's three inks as palette indices: 0 = White, 1 = Black, 2 = Red
+PALETTE = [255, 255, 255,  0, 0, 0,  255, 0, 0]
+PALETTE.extend([0] * (768 - len(PALETTE)))
+BLACK, RED = 1, 2
+
+_palette_image = Image.new('P', (1, 1))
+_palette_image.putpalette(PALETTE)
+
+# Palette index -> layer pixel: each layer is white (255) except where its own ink is.
+# point() runs these over the whole image in C instead of a Python loop per pixel.
+BLACK_LUT = [0 if i == BLACK else 255 for i in range(256)]
+RED_LUT = [0 if i == RED else 255 for i in range(256)]
+
+# --- DITHERING ENGINES ---
+# Roughly fastest to best looking:
+#   none             nearest ink per pixel, flat areas and hard edges only
+#   bayer            8x8 ordered dither, whole-image ops only; good for batches of slides
+#   floyd_steinberg  PIL's error diffusion, what uploads always used
+#   atkinson         error diffusion that keeps highlights and shadows clean; slowest, for hero photos
+DEFAULT_DITHER = 'floyd_steinberg'
+
+def _bayer(n):
+    """The n x n Bayer threshold matrix (n a power of 2), values 0..n*n-1."""
+    m = [[0]]
+    while len(m) < n:
+        m = ([[4 * v for v in row] + [4 * v + 2 for v in row] for row in m]
+             + [[4 * v + 3 for v in row] + [4 * v + 1 for v in row] for row in m])
+    return m
+
+BAYER = _bayer(8)
+_bayer_tiles = {}
+
+def _bayer_tile(size):
+    """The Bayer matrix as an RGB offset image tiled over size (0..255, centred on 128)."""
+    tile = _bayer_tiles.get(size)
+    if tile is None:
+        cell = Image.new('L', (8, 8))
+        cell.putdata([(v * 256 + 128) // 64 for row in BAYER for v in row])
+        # Tile one row of cells, then stack rows
+        row = Image.new('L', (size[0], 8))
+        for x in range(0, size[0], 8):
+            row.paste(cell, (x, 0))
+        plane = Image.new('L', size)
+        for y in range(0, size[1], 8):
+            plane.paste(row, (0, y))
+        tile = _bayer_tiles[size] = Image.merge('RGB', (plane, plane, plane))
+    return tile
+
+def _dither_none(img):
+    return img.quantize(palette=_palette_image, dither=Image.Dither.NONE)
+
+def _dither_bayer(img):
+    # Nudge every pixel by its threshold (-128..127) and take the nearest ink
+    return _dither_none(ImageChops.add(img, _bayer_tile(img.size), 1.0, -128))
+
+def _dither_floyd_steinberg(img):
+    return img.quantize(palette=_palette_image, dither=Image.Dither.FLOYDSTEINBERG)
+
+def _dither_atkinson(img):
+    """
+    Atkinson diffusion: 1/8 of the error to each of six neighbours, the remaining 2/8 dropped.
+    The inks' green and blue are always equal, so the nearest ink only depends on red and
+    green + blue, and only those two channels are diffused.
+    """
+    w, h = img.size
+    # Rows padded by 1 on the left, 2 on the right and 2 below, so neighbours never need bounds checks
+    stride = w + 3
+    red = [0] * (stride * (h + 2))
+    rest = [0] * (stride * (h + 2))
+    r_band, g_band, b_band = (band.tobytes() for band in img.split())
+    for y in range(h):
+        src, dst = y * w, y * stride + 1
+        red[dst:dst + w] = r_band[src:src + w]
+        rest[dst:dst + w] = [g + b for g, b in zip(g_band[src:src + w], b_band[src:src + w])]
+
+    out = bytearray(w * h)
+    for y in range(h):
+        i = y * stride + 1
+        o = y * w
+        for _ in range(w):
+            r, s = red[i], rest[i]
+            if r > 127:
+                # Red is nearer than black; white wins if green + blue is high enough
+                if s > 255:
+                    er, es = r - 255, s - 510
+                else:
+                    out[o] = RED
+                    er, es = r - 255, s
+            elif r + s > 382:
+                er, es = r - 255, s - 510
+            else:
+                out[o] = BLACK
+                er, es = r, s
+            er >>= 3
+            es >>= 3
+            if er or es:
+                for n in (i + 1, i + 2, i + stride - 1, i + stride, i + stride + 1, i + 2 * stride):
+                    red[n] += er
+                    rest[n] += es
+            i += 1
+            o += 1
+
+    img_converted = Image.frombytes('P', (w, h), bytes(out))
+    img_converted.putpalette(PALETTE)
+    return img_converted
+
+DITHER_ENGINES = {
+    'none': _dither_none,
+    'bayer': _dither_bayer,
+    'floyd_steinberg': _dither_floyd_steinberg,
+    'atkinson': _dither_atkinson,
+}
+
+def quantize(img, dither=DEFAULT_DITHER):
+    """Maps an RGB image onto the White/Black/Red palette with the given dithering engine."""
+    engine = DITHER_ENGINES.get(dither)
+    if engine is None:
+        print(f"[-] Unknown dither engine '{dither}', using {DEFAULT_DITHER}.")
+        engine = DITHER_ENGINES[DEFAULT_DITHER]
+    return engine(img)
+
+def split_layers(img_converted):
+    """Splits a quantized ('P') image into its 1-bit Black and Red layers."""
+    return img_converted.point(BLACK_LUT, '1'), img_converted.point(RED_LUT, '1')
+
+def to_layers(img, dither=DEFAULT_DITHER):
+    """RGB image -> (black layer, red layer), ready to pack into a frame with frames.save_layers()."""
+    start = time.time()
+    layers = split_layers(quantize(img, dither))
+    print(f"[*] Dithered {img.size[0]}x{img.size[1]} with {dither} in {time.time() - start:.2f}s")
+    return layers
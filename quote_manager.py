@@ -1,64 +1,185 @@
 import os
-import csv
-import random
-from PIL import ImageDraw, ImageFont
+import sqlite3
+import threading
+from collections import OrderedDict
+import quote_store
+from jobs import submit, get_job
+from fonts import get_font, QUOTE_SIZES
 
 QUOTES_DIR = os.path.join('uploads', 'quotes')
 os.makedirs(QUOTES_DIR, exist_ok=True)
 
-def wrap_text_by_pixels(text, font, max_width, draw):
-    """Wraps text into lines based on the actual pixel width of the rendered font."""
-    words = text.split()
+# The quotes page's text box. Every quote's layout for it is precomputed when its CSV is uploaded.
+QUOTE_BOX = (720, 360)
+
+# Fitted layouts by (quote id, box size), so a quote that comes round again isn't re-measured
+MAX_LAYOUTS = 4096  # A layout is a few short lines, so this is well under a megabyte
+_layouts = OrderedDict()
+_lock = threading.Lock()
+stats = {"hits": 0, "misses": 0}
+
+# Id of each CSV's latest layout job (see jobs.submit()), by CSV filename
+_jobs = {}
+
+def measure_words(words, font):
+    """Each word's pixel width and the width of a space, measured once per font size."""
+    return [font.getlength(word) for word in words], font.getlength(" ")
+
+def wrap_words(words, widths, space, max_width):
+    """
+    Greedy wrap on pre-measured widths. A line from word i to word j is
+    cumulative[j + 1] - cumulative[i] + (j - i) spaces wide, so no prefix is ever re-measured.
+    """
+    cumulative = [0]
+    for width in widths:
+        cumulative.append(cumulative[-1] + width)
+
     lines = []
-    current_line = ""
-    
-    for word in words:
-        test_line = f"{current_line} {word}".strip()
-        # draw.textlength returns the width of the string in pixels
-        if draw.textlength(test_line, font=font) <= max_width:
-            current_line = test_line
-        else:
-            if current_line:
-                lines.append(current_line)
-            current_line = word
-    if current_line:
-        lines.append(current_line)
+    start = 0
+    for end in range(1, len(words)):
+        # Would adding words[end] push the line past the box? A single long word still gets its own line.
+        if cumulative[end + 1] - cumulative[start] + (end - start) * space > max_width:
+            lines.append(" ".join(words[start:end]))
+            start = end
+    if words:
+        lines.append(" ".join(words[start:]))
     return lines
 
-def calculate_best_fit(quote_text, author, draw, max_width=720, max_height=360):
+def fit_at(words, size, max_width, max_height):
+    """Wraps the quote at one font size. Returns (lines, line_height) or None if it's too tall."""
+    lines = wrap_words(words, *measure_words(words, get_font(size, "regular")), max_width)
+
+    # Approximate line height is usually 1.2x the font size
+    line_height = size * 1.2
+
+    # Total height = (Number of lines * line height) + (Blank space) + (Author text height)
+    total_height = (len(lines) * line_height) + (size * 1.5)
+    return (lines, line_height) if total_height <= max_height else None
+
+def best_fit(words, max_width, max_height):
     """
-    Iteratively shrinks the font size until the wrapped text and author fit in the bounding box.
-    Returns (lines, quote_font, author_font, line_height) or Nones if it absolutely won't fit.
+    Finds the largest font size at which the wrapped words and author fit in the bounding box.
+    Returns (size, lines, line_height), or None if it absolutely won't fit.
     """
-    max_font_size = 72
-    min_font_size = 24
+    # Fewer pixels per word never means more lines, so the sizes that fit are a tail of
+    # QUOTE_SIZES (72 -> 24) and the largest of them can be binary-searched
+    sizes = list(QUOTE_SIZES)
+    lo, hi = 0, len(sizes)
+    best = None
+    while lo < hi:
+        mid = (lo + hi) // 2
+        fit = fit_at(words, sizes[mid], max_width, max_height)
+        if fit:
+            best, hi = (sizes[mid], *fit), mid
+        else:
+            lo = mid + 1
+    return best
 
-    for size in range(max_font_size, min_font_size - 1, -4):
-        try:
-            # You can point this to your specific font paths
-            font_quote = ImageFont.truetype("fonts/roboto/Roboto-Regular.ttf", size)
-            font_author = ImageFont.truetype("fonts/roboto/Roboto-Black.ttf", max(20, size - 12))
-        except Exception:
-            font_quote = font_author = ImageFont.load_default()
+def fonts_for(size):
+    """The (quote, author) fonts for a fitted size."""
+    return get_font(size, "regular"), get_font(max(20, size - 12), "black")
 
-        lines = wrap_text_by_pixels(quote_text, font_quote, max_width, draw)
-        
-        # Approximate line height is usually 1.2x the font size
-        line_height = size * 1.2
-        
-        # Total height = (Number of lines * line height) + (Blank space) + (Author text height)
-        total_height = (len(lines) * line_height) + (size * 1.5) 
-        
-        if total_height <= max_height:
-            return lines, font_quote, font_author, line_height
-            
-    # If it finishes the loop and still doesn't fit, it's too long!
-    return None, None, None, None
+def calculate_best_fit(quote_text, author, draw=None, max_width=QUOTE_BOX[0], max_height=QUOTE_BOX[1], quote_id=None):
+    """
+    Returns (lines, quote_font, author_font, line_height) for the largest size that fits the box,
+    or Nones if it absolutely won't fit.
+    Pass quote_id to reuse the layout the next time the same quote is shown in the same box.
+    """
+    key = (quote_id, max_width, max_height)
+    if quote_id is not None:
+        with _lock:
+            cached = _layouts.get(key)
+            if cached is not None and cached[0] == quote_text:
+                _layouts.move_to_end(key)
+                stats["hits"] += 1
+                return cached[1]
+            stats["misses"] += 1
+
+    best = best_fit(quote_text.split(), max_width, max_height)
+    if best:
+        size, lines, line_height = best
+        result = (lines, *fonts_for(size), line_height)
+    else:
+        # Even the smallest size doesn't fit, it's too long!
+        result = None, None, None, None
+
+    if quote_id is not None:
+        with _lock:
+            _layouts[key] = (quote_text, result)
+            while len(_layouts) > MAX_LAYOUTS:
+                _layouts.popitem(last=False)
+    return result
+
+def layout_stats():
+    with _lock:
+        return dict(stats, cached=len(_layouts))
+
+# --- LAYOUT JOBS ---
+def precompute_layouts(csv_path, compile=True):
+    """
+    Compiles a CSV's store (unless it's already current) and fits every quote in it to QUOTE_BOX,
+    saving the layouts in the store. Quotes that can't fit are flagged with size 0 and never picked.
+    Runs in a worker process (see start_precompute()); returns how many quotes were laid out.
+    """
+    name = os.path.basename(csv_path)
+    if compile:
+        quote_store.compile_csv(csv_path)
+    db_path, meta = quote_store.open_store(csv_path)
+
+    done = too_long = 0
+    for chunk in quote_store.iter_quotes(db_path):
+        # Stop if the CSV was deleted or re-uploaded (its new job takes over)
+        if not os.path.exists(csv_path) or not quote_store.is_current(csv_path, db_path):
+            return done
+        layouts = []
+        for rowid, text in chunk:
+            best = best_fit((text or '').split(), *QUOTE_BOX)
+            if best and best[1]:
+                layouts.append((rowid, best[0], best[1]))
+            else:
+                layouts.append((rowid, 0, []))
+                too_long += 1
+        done += len(chunk)
+        quote_store.save_layouts(db_path, layouts, done)
+
+    print(f"[*] Laid out {done} quotes from {name} ({too_long} too long for the screen)")
+    return done
+
+def start_precompute(csv_path, compile=True):
+    """Runs precompute_layouts() in the worker pool, so fitting a big CSV never holds this process's GIL."""
+    job_id = submit('quotes', precompute_layouts, csv_path, compile)
+    with _lock:
+        _jobs[os.path.basename(csv_path)] = job_id
+    return job_id
+
+def precompute_progress():
+    """
+    Progress of every layout job started since boot, by CSV filename: the job's state
+    (see jobs.get_job()) and how far its store has got.
+    """
+    with _lock:
+        job_ids = dict(_jobs)
+    progress = {}
+    for name, job_id in job_ids.items():
+        job = get_job(job_id)
+        if job is None:
+            continue
+        entry = {"state": job["state"], "error": job["error"], "done": 0, "total": 0, "too_long": 0}
+        db_path = quote_store.store_paths(os.path.join(QUOTES_DIR, name))[0]
+        try:
+            # Checked first: connecting to a missing store would create an empty one
+            if os.path.exists(db_path):
+                meta = quote_store.get_meta(db_path)
+                entry.update(done=meta['layouts'], total=meta['count'], too_long=meta['layouts'] - meta['playable'])
+        except (sqlite3.Error, KeyError):
+            pass  # Still being compiled
+        progress[name] = entry
+    return progress
 
 def get_next_quote(state, draw):
     """
-    Reads the active CSV, filters out shown quotes, picks a random one,
-    and calculates the layout. If it doesn't fit, it tries the next one.
+    Takes the next quote from the active CSV's shuffle and looks up its precomputed layout
+    (or fits it now if the CSV's layout job hasn't got to it yet).
     """
     active_csv = state.get('active_quote_csv')
     if not active_csv:
@@ -68,42 +189,39 @@ def get_next_quote(state, draw):
     if not os.path.exists(csv_path):
         return {"error": f"CSV '{active_csv}' not found."}
 
-    # 1. Read the CSV (Expects columns: id, person, quote)
-    all_quotes = []
+    # 1. Open the CSV's indexed store (compiled at upload, or now if the CSV predates it)
     try:
-        with open(csv_path, mode='r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                all_quotes.append(row)
+        db_path, meta = quote_store.open_store(csv_path)
     except Exception as e:
         return {"error": f"Error reading CSV: {e}"}
 
-    if not all_quotes:
+    if not meta['count']:
         return {"error": "CSV is empty."}
 
-    # 2. Filter out already shown quotes
-    shown_ids = state.get('shown_quotes', [])
-    available_quotes = [q for q in all_quotes if q.get('id') not in shown_ids]
-
-    # If we've shown everything, reset the list!
-    if not available_quotes:
-        shown_ids = []
-        available_quotes = all_quotes
-
-    # 3. Pick a random quote and test if it fits
-    random.shuffle(available_quotes)
-    
-    for selected in available_quotes:
-        text = selected.get('quote', '')
-        author = selected.get('person', 'Unknown')
-        
-        lines, font_q, font_a, lh = calculate_best_fit(text, author, draw)
+    # Shown quotes are tracked by the store's cursor now
+    state.pop('shown_quotes', None)
+
+    # Stores compiled outside an upload (or whose job was cut short by a restart) still need layouts
+    job = get_job(_jobs.get(active_csv))
+    if meta['layouts'] < meta['count'] and (job is None or job["state"] not in ("queued", "running")):
+        start_precompute(csv_path, compile=False)
+
+    # 2. Take quotes in shuffled order until one fits (each is tried at most once per call)
+    for _ in range(meta['count']):
+        rowid = quote_store.next_rowid(csv_path, db_path, meta)
+        if rowid is None:
+            break
+        selected = quote_store.get_quote(db_path, rowid)
+        author = selected.get('person') or 'Unknown'
+
+        if selected['size'] is not None:
+            # Laid out at upload: size 0 means it was found too long
+            size = selected['size']
+            lines, font_q, font_a, lh = (selected['lines'], *fonts_for(size), size * 1.2) if size else (None,) * 4
+        else:
+            lines, font_q, font_a, lh = calculate_best_fit(selected.get('quote') or '', author, draw, quote_id=(active_csv, selected.get('id')))
         
         if lines: # We found a fit!
-            # Update the state with the newly shown ID
-            shown_ids.append(selected.get('id'))
-            state['shown_quotes'] = shown_ids
-            
             return {
                 "lines": lines,
                 "author": author,
@@ -113,9 +231,8 @@ def get_next_quote(state, draw):
             }
             
         else:
+            # The cursor has already moved past it, so it won't be retried until the next pass
             print(f"[*] Skipping quote ID {selected.get('id')} - Too long to fit.")
-            # Add to shown_ids so we don't infinitely retry it later
-            shown_ids.append(selected.get('id'))
             
-    # If we looped through the entire shuffled list and NOTHING fit
-    return {"error": "All remaining quotes are too long for the screen."}
\ No newline at end of file
+    # If we went through the entire CSV and NOTHING fit
+    return {"error": "All quotes are too long for the screen."}
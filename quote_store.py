@@ -0,0 +1,170 @@
+import os
+import csv
+import json
+import random
+import sqlite3
+import tempfile
+import threading
+from contextlib import closing
+
+# Each quote CSV is compiled once into a SQLite store next to it (foo.csv -> foo.db), with the
+# quotes at rowids 1..count so any one of them is a single indexed lookup.
+# The store also holds each quote's fitted layout (font size and line breaks), computed in the
+# background after upload; size 0 marks a quote that can't fit on the screen.
+# Which quotes were shown is a cursor into a seeded shuffle of the playable rowids
+# (foo.cursor.json): a seed and a position, so it stays a few bytes no matter how big the library gets.
+
+STORE_VERSION = 2
+
+_lock = threading.RLock()
+_permutations = {}  # (db path, seed, count) -> shuffled rowids, rebuilt once per pass
+
+def store_paths(csv_path):
+    base = os.path.splitext(csv_path)[0]
+    return base + '.db', base + '.cursor.json'
+
+def compile_csv(csv_path):
+    """Builds the store for a CSV (expects columns: id, person, quote). Returns the number of quotes."""
+    db_path, cursor_path = store_paths(csv_path)
+    # Built in a file of its own, so neither readers nor another build of the same CSV wait on it
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(db_path) + '.', suffix='.tmp', dir=os.path.dirname(db_path) or '.')
+    os.close(fd)
+    try:
+        stat = os.stat(csv_path)
+        with open(csv_path, mode='r', encoding='utf-8') as f, closing(sqlite3.connect(tmp_path)) as db:
+            db.execute("CREATE TABLE quotes (rowid INTEGER PRIMARY KEY, id TEXT, person TEXT, quote TEXT)")
+            db.execute("CREATE TABLE layouts (rowid INTEGER PRIMARY KEY, size INTEGER, lines TEXT)")
+            db.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value INTEGER)")
+            db.executemany("INSERT INTO quotes (id, person, quote) VALUES (?, ?, ?)",
+                           ((row.get('id') or str(n), row.get('person'), row.get('quote')) for n, row in enumerate(csv.DictReader(f), 1)))
+            count = db.execute("SELECT COUNT(*) FROM quotes").fetchone()[0]
+            db.executemany("INSERT INTO meta VALUES (?, ?)", [('version', STORE_VERSION), ('mtime_ns', stat.st_mtime_ns),
+                                                              ('size', stat.st_size), ('count', count), ('layouts', 0), ('playable', 0)])
+            db.commit()
+
+        # Swap it in whole, so a render never sees a half-built store, and start its shuffle over
+        with _lock:
+            os.replace(tmp_path, db_path)
+            if os.path.exists(cursor_path):
+                os.remove(cursor_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    print(f"[*] Compiled {count} quotes from {os.path.basename(csv_path)}")
+    return count
+
+def remove_store(csv_path):
+    with _lock:
+        for path in store_paths(csv_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+def get_meta(db_path):
+    with closing(sqlite3.connect(db_path)) as db:
+        return dict(db.execute("SELECT key, value FROM meta"))
+
+def open_store(csv_path):
+    """Returns (db path, meta), compiling the CSV first if its store is missing or older than it."""
+    db_path = store_paths(csv_path)[0]
+    if not is_current(csv_path, db_path):
+        compile_csv(csv_path)
+    return db_path, get_meta(db_path)
+
+def is_current(csv_path, db_path):
+    """True if the store at db_path was compiled from the CSV as it is now."""
+    stat = os.stat(csv_path)
+    try:
+        meta = get_meta(db_path)
+    except sqlite3.Error:
+        return False
+    return (meta.get('version') == STORE_VERSION and meta.get('mtime_ns') == stat.st_mtime_ns
+            and meta.get('size') == stat.st_size)
+
+def iter_quotes(db_path, batch=500):
+    """
+    Yields lists of (rowid, quote) for every quote, batch at a time. Each batch is its own
+    short read, so the store can be written to between them.
+    """
+    last = 0
+    while True:
+        with closing(sqlite3.connect(db_path)) as db:
+            chunk = db.execute("SELECT rowid, quote FROM quotes WHERE rowid > ? ORDER BY rowid LIMIT ?", (last, batch)).fetchall()
+        if not chunk:
+            break
+        yield chunk
+        last = chunk[-1][0]
+
+def save_layouts(db_path, layouts, done):
+    """Stores (rowid, size, lines) layouts; done is how many quotes now have one."""
+    with closing(sqlite3.connect(db_path)) as db:
+        db.executemany("INSERT OR REPLACE INTO layouts VALUES (?, ?, ?)",
+                       ((rowid, size, "\n".join(lines)) for rowid, size, lines in layouts))
+        db.execute("UPDATE meta SET value = ? WHERE key = 'layouts'", (done,))
+        db.execute("UPDATE meta SET value = (SELECT COUNT(*) FROM layouts WHERE size > 0) WHERE key = 'playable'")
+        db.commit()
+
+def get_quote(db_path, rowid):
+    """Returns one quote as {'id', 'person', 'quote', 'size', 'lines'}; size is None until it's been laid out."""
+    with closing(sqlite3.connect(db_path)) as db:
+        row = db.execute("SELECT q.id, q.person, q.quote, l.size, l.lines FROM quotes q "
+                         "LEFT JOIN layouts l ON l.rowid = q.rowid WHERE q.rowid = ?", (rowid,)).fetchone()
+    if not row:
+        return None
+    quote = dict(zip(('id', 'person', 'quote', 'size', 'lines'), row))
+    quote['lines'] = quote['lines'].split("\n") if quote['lines'] else []
+    return quote
+
+def _playable_count(meta):
+    """Until every quote is laid out they are all candidates; after that, only the ones that fit."""
+    return meta['count'] if meta['layouts'] < meta['count'] else meta['playable']
+
+def _playable_rowids(db_path, meta):
+    if meta['layouts'] < meta['count']:
+        return list(range(1, meta['count'] + 1))
+    with closing(sqlite3.connect(db_path)) as db:
+        return [r for (r,) in db.execute("SELECT rowid FROM layouts WHERE size > 0 ORDER BY rowid")]
+
+def _load_cursor(cursor_path, count):
+    try:
+        with open(cursor_path, 'r') as f:
+            cursor = json.load(f)
+        if cursor.get('count') == count:
+            return cursor
+    except (OSError, ValueError):
+        pass
+    return {"seed": random.getrandbits(32), "position": 0, "count": count}
+
+def _save_cursor(cursor_path, cursor):
+    tmp_path = cursor_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(cursor, f)
+    os.replace(tmp_path, cursor_path)
+
+def next_rowid(csv_path, db_path, meta):
+    """
+    Takes the next rowid from this CSV's shuffle, or None if nothing is playable.
+    When every quote has been shown, starts a new shuffle.
+    """
+    cursor_path = store_paths(csv_path)[1]
+    with _lock:
+        count = _playable_count(meta)
+        if not count:
+            return None
+        cursor = _load_cursor(cursor_path, count)
+        if cursor['position'] >= count:
+            cursor = {"seed": random.getrandbits(32), "position": 0, "count": count}
+
+        key = (db_path, cursor['seed'], count)
+        order = _permutations.get(key)
+        if order is None:
+            order = _playable_rowids(db_path, meta)
+            random.Random(cursor['seed']).shuffle(order)
+            # Only the active pass of each store is worth keeping
+            for old in [k for k in _permutations if k[0] == db_path]:
+                del _permutations[old]
+            _permutations[key] = order
+
+        rowid = order[cursor['position']]
+        cursor['position'] += 1
+        _save_cursor(cursor_path, cursor)
+    return rowid
@@ -2,8 +2,12 @@ import os
 import json
 import subprocess
 import socket
-from PIL import Image, ImageChops
+import time
+import resource
+from PIL import Image, ImageChops, ImageOps
 from zeroconf import IPVersion, ServiceInfo, Zeroconf
+from palette import to_layers, DEFAULT_DITHER
+from frames import save_layers
 
 # --- STATE MANAGEMENT ---
 def load_state(filepath="state.json"):
@@ -79,31 +83,91 @@ def register_mdns():
     return zc, info
 
 # --- IMAGE PROCESSING ---
-def process_upload(filepath, upload_dir='uploads'):
-    """Converts uploaded RGB image into two separate 1-bit BMPs for the V2 display (3-color palette)."""
+PANEL_SIZE = (800, 480)
+THUMB_SIZE = (160, 96) # Scaled perfectly to match the 800x480 screen aspect ratio
+# Most pixels we'll decode (after JPEG draft scaling): ~36 MB as RGB, which a 512 MB Pi can spare
+MAX_DECODE_PIXELS = 12_000_000
+FRAME_NAME = 'photo.epd'
+
+def reset_peak_rss():
+    """
+    Restarts this process's peak resident memory count from its current size (Linux: writing 5
+    to clear_refs resets VmHWM). Returns False where that isn't supported.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def peak_rss_mb():
+    """Peak resident memory since the last reset_peak_rss(), or over the process's lifetime without /proc."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in KB on Linux, and never goes down
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def open_image(filepath, size=PANEL_SIZE):
+    """
+    Opens an image for the panel. JPEGs are decoded at the smallest 1/2, 1/4 or 1/8 scale
+    that still covers size, so a 4000px photo never exists in memory at full resolution.
+    Anything still over MAX_DECODE_PIXELS is refused before it's decoded.
+    Returns (image, original size).
+    """
+    img = Image.open(filepath)
+    original = img.size
+    img.draft('RGB', size)  # No-op for formats other than JPEG
+    if img.width * img.height > MAX_DECODE_PIXELS:
+        img.close()
+        raise ValueError(f"{original[0]}x{original[1]} image is over the {MAX_DECODE_PIXELS // 1_000_000} MP decode budget")
+    img.load()
+    return img, original
+
+def process_upload(filepath, upload_dir='uploads', dither=DEFAULT_DITHER, thumbnail=None, name=FRAME_NAME):
+    """
+    Converts uploaded RGB image into the V2 display's two 1-bit layers (3-color palette),
+    saved in upload_dir as a packed frame called name (see frames.py).
+    dither picks the engine (see palette.DITHER_ENGINES). thumbnail, if given, is a path to also
+    save a small color preview to, made from the same decode.
+    """
     os.makedirs(upload_dir, exist_ok=True)
-    img = Image.open(filepath).resize((800, 480)).convert("RGB")
-    
-    # Quantize to 3 colors: White, Black, Red
-    palettedata = [255, 255, 255,  0, 0, 0,  255, 0, 0] 
-    palettedata.extend([0] * (768 - len(palettedata)))
-    palimage = Image.new('P', (1, 1))
-    palimage.putpalette(palettedata)
-    img_converted = img.quantize(palette=palimage)
-    
-    img_black = Image.new('1', (800, 480), 255)
-    img_red = Image.new('1', (800, 480), 255)
+    # Measure this ingest's own peak, not the worst one this worker has ever done
+    per_ingest = reset_peak_rss()
+    start, rss_before = time.time(), peak_rss_mb()
+    decoded, original = open_image(filepath)
+
+    if thumbnail:
+        try:
+            ImageOps.contain(decoded, THUMB_SIZE).convert("RGB").save(thumbnail)
+        except Exception as e:
+            print(f"[-] Error generating thumbnail: {e}")
+
+    img = decoded.resize(PANEL_SIZE).convert("RGB")
+    decoded_size = decoded.size
+    decoded.close()
     
-    p_black, p_red = img_black.load(), img_red.load()
-    p_old = img_converted.load()
+    # Quantize to 3 colors: White, Black, Red, and split into one 1-bit layer per ink
+    img_black, img_red = to_layers(img, dither)
     
-    for y in range(480):
-        for x in range(800):
-            if p_old[x, y] == 1: p_black[x,y] = 0   # Draw to Black Layer
-            elif p_old[x, y] == 2: p_red[x,y] = 0   # Draw to Red Layer
-            
-    img_black.save(os.path.join(upload_dir, 'black_layer.bmp'))
-    img_red.save(os.path.join(upload_dir, 'red_layer.bmp'))
+    save_layers(os.path.join(upload_dir, name), img_black, img_red,
+                {"source": os.path.basename(filepath), "original": list(original), "dither": dither, "created": int(time.time())})
+
+    peak, scope = peak_rss_mb(), "peak RSS" if per_ingest else "lifetime peak RSS"
+    print(f"[*] Ingested {os.path.basename(filepath)}: {original[0]}x{original[1]} decoded at "
+          f"{decoded_size[0]}x{decoded_size[1]} in {time.time() - start:.2f}s, {scope} {peak:.0f} MB (+{peak - rss_before:.0f} MB)")
+
+def ingest_upload(filepath, upload_dir='uploads', dither=DEFAULT_DITHER, thumbnail=None, name=FRAME_NAME):
+    """process_upload() as a background job: the uploaded file is deleted afterwards, whatever happens."""
+    try:
+        process_upload(filepath, upload_dir, dither, thumbnail, name)
+    finally:
+        os.remove(filepath)
 
 def calculate_bw_diff(old_image_path, new_image_path):
     """
@@ -0,0 +1,379 @@
+import os
+from collections import namedtuple
+from PIL import Image, ImageDraw
+from display import get_background, load_fonts
+from assets import get_image
+from frames import get_frame, get_layers
+from driver.packing import pack_planes
+from glyphs import GlyphSet, render_strip
+from markdown_layout import layout_markdown
+
+# A page is a Layout: a list of widgets, each knowing the area it paints (bbox), the
+# context values it reads (deps) and a hash of what it would draw from them.
+# Widgets without deps never change and are baked into the cached page background;
+# the rest are repainted only when their hash changes, so a refresh only touches
+# (and the panel only partially refreshes) what actually changed.
+
+FONT_NAMES = ('large', 'med', 'small')
+
+def get_font(font):
+    """Accepts a font name from FONT_NAMES or an already loaded font."""
+    if isinstance(font, str):
+        return load_fonts()[FONT_NAMES.index(font)]
+    return font
+
+_glyph_sets = {}
+
+def get_glyphs(font):
+    glyphs = _glyph_sets.get(font)
+    if glyphs is None:
+        glyphs = _glyph_sets[font] = GlyphSet(font)
+    return glyphs
+
+# A frame rendered by Layout.draft() but not committed yet. base is the layout's hashes it was drawn over;
+# planes are the packed planes of a frame file that makes up the whole page, else None.
+Draft = namedtuple('Draft', 'black red repaint hashes config generation planes base')
+
+def draft_planes(draft):
+    """A Layout.draft() as packed planes for push_planes(): straight from its frame file when it has one."""
+    return draft.planes or pack_planes(draft.black, draft.red)
+
+def overlaps(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+class Context:
+    """Named data sources for one render. Each is computed on first use and then reused."""
+    def __init__(self, sources, **values):
+        self.sources = sources
+        self.values = values
+
+    def __getitem__(self, name):
+        if name not in self.values:
+            self.values[name] = self.sources[name](self)
+        return self.values[name]
+
+# --- WIDGETS ---
+class Widget:
+    """
+    Base widget. live widgets are re-checked on every clock tick; the others only
+    when the page is rendered. Subclasses implement paint().
+    """
+    covers = False  # Whether planes() can ever return a whole frame
+
+    def __init__(self, bbox=None, deps=(), live=False):
+        self.bbox = bbox
+        self.deps = tuple(deps)
+        self.live = live
+
+    @property
+    def static(self):
+        return not self.deps
+
+    def inputs(self, ctx):
+        return tuple(ctx[d] for d in self.deps)
+
+    def content_hash(self, ctx):
+        return hash(repr(self.inputs(ctx)))
+
+    def paint(self, img_black, img_red, ctx):
+        raise NotImplementedError
+
+    def strip(self, ctx):
+        """Packed black-only (rect, data) rendering for ticks, or None if not supported."""
+        return None
+
+    def blank(self, ctx):
+        """True if paint() would draw nothing at all."""
+        return False
+
+    def planes(self, ctx):
+        """Packed planes of a whole frame this widget would paint over everything, or None."""
+        return None
+
+class Text(Widget):
+    """
+    Text at xy. text is a string, or a function of the deps' values returning a string,
+    None (draw nothing) or a list of (x, y, text, font, layer) runs.
+    opaque fills the bbox white on its layer first (e.g. a caption over a photo).
+    glyphs lets ticks render it from pre-rasterized glyph strips (single-line black text only).
+    """
+    def __init__(self, xy, text, font='med', layer='black', bbox=None, deps=(), live=False, glyphs=False, opaque=False):
+        super().__init__(bbox, deps, live)
+        self.xy = xy
+        self.text = text
+        self.font = font
+        self.layer = layer
+        self.glyphs = glyphs
+        self.opaque = opaque
+
+    def runs(self, ctx):
+        text = self.text(*self.inputs(ctx)) if callable(self.text) else self.text
+        if not text:
+            return []
+        if isinstance(text, str):
+            return [(self.xy[0], self.xy[1], text, self.font, self.layer)]
+        return text
+
+    def paint(self, img_black, img_red, ctx):
+        draws = {'black': ImageDraw.Draw(img_black), 'red': ImageDraw.Draw(img_red)}
+        if self.opaque:
+            draws[self.layer].rectangle(self.bbox, fill=255)
+        for x, y, text, font, layer in self.runs(ctx):
+            draws[layer].text((x, y), text, font=get_font(font), fill=0)
+
+    def blank(self, ctx):
+        return not self.opaque and not self.runs(ctx)
+
+    def strip(self, ctx):
+        runs = self.runs(ctx)
+        if not self.glyphs or self.opaque or any(layer != 'black' or '\n' in text for _, _, text, _, layer in runs):
+            return None
+        return render_strip(self.bbox, [(x, y, text, get_glyphs(get_font(font))) for x, y, text, font, _ in runs])
+
+class Clock(Text):
+    """The local time (context value 'time'), optionally formatted. Always live and glyph-rendered."""
+    def __init__(self, xy, font='large', bbox=None, fmt=None):
+        super().__init__(xy, fmt or (lambda t: t), font, bbox=bbox, deps=('time',), live=True, glyphs=True)
+
+class List(Text):
+    """
+    Rows starting at xy, step pixels apart. items is a function of the deps' values returning
+    a list of rows; a row is a string or a list of (dx, text, layer) cells.
+    """
+    def __init__(self, xy, items, font='med', step=50, layer='black', bbox=None, deps=(), live=False, glyphs=False):
+        super().__init__(xy, self._rows, font, layer, bbox, deps, live, glyphs)
+        self.items = items
+        self.step = step
+
+    def _rows(self, *values):
+        x, y = self.xy
+        runs = []
+        for row in self.items(*values):
+            for dx, text, layer in ([(0, row, self.layer)] if isinstance(row, str) else row):
+                runs.append((x + dx, y, text, self.font, layer))
+            y += self.step
+        return runs
+
+class Line(Widget):
+    def __init__(self, points, width=1, layer='black'):
+        super().__init__()
+        self.points = points
+        self.width = width
+        self.layer = layer
+
+    def paint(self, img_black, img_red, ctx):
+        img = img_black if self.layer == 'black' else img_red
+        ImageDraw.Draw(img).line(self.points, fill=0, width=self.width)
+
+class Icon(Widget):
+    """A small image pasted at xy. show, a function of the deps' values, can hide it."""
+    def __init__(self, xy, path, size=None, layer='black', bbox=None, deps=(), show=None):
+        super().__init__(bbox, deps)
+        self.xy = xy
+        self.path = path
+        self.size = size
+        self.layer = layer
+        self.show = show
+
+    def visible(self, ctx):
+        return os.path.exists(self.path) and (self.show is None or self.show(*self.inputs(ctx)))
+
+    def content_hash(self, ctx):
+        return hash((self.visible(ctx), repr(self.inputs(ctx))))
+
+    def paint(self, img_black, img_red, ctx):
+        if self.visible(ctx):
+            img = img_black if self.layer == 'black' else img_red
+            img.paste(get_image(self.path, "1", self.size), self.xy)
+
+class Picture(Widget):
+    """
+    Pre-baked Black/Red layers pasted at xy. paths is a function of the deps' values returning
+    the path of a packed frame (see frames.py), a (black_path, red_path) pair of layer images,
+    either of which may be None, or None to draw nothing.
+    The files' mtimes are part of the hash, so re-uploading an image repaints it.
+    """
+    def __init__(self, paths, xy=(0, 0), bbox=(0, 0, 800, 480), deps=()):
+        super().__init__(bbox, deps)
+        self.paths = paths
+        self.xy = xy
+        self.covers = xy == (0, 0) and tuple(bbox) == (0, 0, 800, 480)
+
+    def files(self, ctx):
+        paths = self.paths(*self.inputs(ctx)) or (None, None)
+        if isinstance(paths, str):
+            paths = (paths,)
+        return [p if p and os.path.exists(p) else None for p in paths]
+
+    def content_hash(self, ctx):
+        return hash(tuple((p, os.path.getmtime(p)) if p else None for p in self.files(ctx)))
+
+    def layers(self, ctx):
+        files = self.files(ctx)
+        if len(files) == 1:
+            return get_layers(files[0]) if files[0] else (None, None)
+        return [get_image(p) if p else None for p in files]
+
+    def paint(self, img_black, img_red, ctx):
+        for img, layer in zip((img_black, img_red), self.layers(ctx)):
+            if layer is not None:
+                img.paste(layer, self.xy)
+
+    def blank(self, ctx):
+        return not any(self.files(ctx))
+
+    def planes(self, ctx):
+        files = self.files(ctx)
+        if self.covers and len(files) == 1 and files[0]:
+            frame = get_frame(files[0])
+            return frame.black, frame.red
+        return None
+
+class Markdown(Text):
+    """The scratchpad's Markdown (see markdown_layout.py) from a context value, laid out once per distinct text."""
+    def __init__(self, dep, bbox=(0, 0, 800, 480)):
+        super().__init__((0, 0), layout_markdown, bbox=bbox, deps=(dep,))
+
+# --- LAYOUT ---
+class Layout:
+    """
+    A page/mode's widgets plus what was last rendered for it, so the next render can
+    start from the previous frame and repaint only the widgets whose hash changed.
+    """
+    def __init__(self, key, widgets):
+        self.key = key
+        self.widgets = widgets
+        self.static = [w for w in widgets if w.static]
+        self.dynamic = [w for w in widgets if not w.static]
+        self.live = [w for w in widgets if w.live]
+        self.covering = any(w.covers for w in widgets)
+        self.layers = None
+        self.config = None
+        self.hashes = {}
+        self.generation = 0  # Bumped whenever layers/hashes change, so stale drafts can be spotted
+
+    def render(self, ctx, widgets=None):
+        """
+        Returns (img_black, img_red, repainted widgets). Only the given widgets (default: all
+        of them) are re-evaluated; the rest keep what they drew last time.
+        """
+        draft = self.draft(ctx, widgets)
+        self.commit(draft)
+        return draft.black, draft.red, draft.repaint
+
+    def render_planes(self, ctx, widgets=None):
+        """render(), returning (black plane, red plane, repainted widgets) ready for push_planes()."""
+        draft = self.draft(ctx, widgets)
+        self.commit(draft)
+        return draft_planes(draft) + (draft.repaint,)
+
+    def draft(self, ctx, widgets=None):
+        """
+        Renders like render() without remembering the result, e.g. to prepare the next frame
+        ahead of time. Returns a Draft; pass it to commit() once it's on the panel, if
+        is_current() still holds.
+        """
+        config = tuple(w.content_hash(ctx) for w in self.static)
+        bg_black, bg_red = get_background(self.key, self._paint_static(ctx), config)
+
+        candidates = self.dynamic if widgets is None else [w for w in self.dynamic if w in widgets]
+        hashes = {w: w.content_hash(ctx) for w in candidates}
+
+        if self.layers is None or config != self.config:
+            img_black, img_red = bg_black, bg_red
+            repaint = self.dynamic
+            if widgets is not None:
+                # Widgets we weren't asked about have never been drawn on this background
+                hashes.update({w: w.content_hash(ctx) for w in self.dynamic if w not in hashes})
+        else:
+            img_black, img_red = self.layers[0].copy(), self.layers[1].copy()
+            changed = [w for w in candidates if hashes[w] != self.hashes.get(w)]
+            # Wipe each changed widget back to the background, then redraw it and anything it overlaps
+            for w in changed:
+                img_black.paste(bg_black.crop(w.bbox), w.bbox[:2])
+                img_red.paste(bg_red.crop(w.bbox), w.bbox[:2])
+            repaint = [w for w in self.dynamic if any(overlaps(w.bbox, c.bbox) for c in changed)]
+
+        for w in repaint:
+            w.paint(img_black, img_red, ctx)
+        # Only a full render has looked at every widget
+        planes = self._frame_planes(ctx) if widgets is None else None
+        return Draft(img_black, img_red, repaint, hashes, config, self.generation, planes, dict(self.hashes))
+
+    def _frame_planes(self, ctx):
+        """
+        Planes of a full-screen frame that covers everything painted before it, provided
+        nothing painted after it draws anything. Then the page is that frame, bit for bit.
+        """
+        if not self.covering:
+            return None
+        for w in reversed(self.static + self.dynamic):
+            planes = w.planes(ctx)
+            if planes is not None:
+                return planes
+            if not w.blank(ctx):
+                return None
+        return None
+
+    def is_current(self, draft):
+        """
+        True if nothing but live widgets (clock ticks) changed on this layout since the draft
+        was made. refresh() catches the draft up with those.
+        """
+        if draft.generation == self.generation:
+            return True
+        return draft.config == self.config and all(self.hashes.get(w) == draft.base.get(w) for w in self.dynamic if not w.live)
+
+    def refresh(self, draft, ctx):
+        """
+        Repaints the live widgets of a current draft whose value moved on since it was made
+        (and whatever they overlap). Returns the draft, or a new one if anything changed.
+        """
+        changed = [w for w in self.live if w.content_hash(ctx) != draft.hashes.get(w)]
+        if not changed:
+            return draft
+        bg_black, bg_red = get_background(self.key, self._paint_static(ctx), draft.config)
+        img_black, img_red = draft.black.copy(), draft.red.copy()
+        for w in changed:
+            img_black.paste(bg_black.crop(w.bbox), w.bbox[:2])
+            img_red.paste(bg_red.crop(w.bbox), w.bbox[:2])
+        repaint = [w for w in self.dynamic if any(overlaps(w.bbox, c.bbox) for c in changed)]
+        for w in repaint:
+            w.paint(img_black, img_red, ctx)
+        hashes = dict(draft.hashes)
+        hashes.update({w: w.content_hash(ctx) for w in changed})
+        repaint = draft.repaint + [w for w in repaint if w not in draft.repaint]
+        return draft._replace(black=img_black, red=img_red, repaint=repaint, hashes=hashes, planes=None)
+
+    def commit(self, draft):
+        self.hashes.update(draft.hashes)
+        self.layers = (draft.black, draft.red)
+        self.config = draft.config
+        self.generation += 1
+
+    def _paint_static(self, ctx):
+        def build(img_black, img_red):
+            for w in self.static:
+                w.paint(img_black, img_red, ctx)
+        return build
+
+    def tick(self, ctx):
+        """
+        Re-checks only the live widgets. Returns (changed, patches): patches are packed strips
+        for push_patches() when every changed widget can be rendered that way, else None and
+        the caller should render(ctx, changed) and push the frame.
+        """
+        if self.layers is None:
+            return self.live, None
+        changed = [w for w in self.live if w.content_hash(ctx) != self.hashes.get(w)]
+        patches = [w.strip(ctx) for w in changed]
+        if not changed or None in patches:
+            return changed, None if changed else []
+
+        # Keep the remembered frame in step with what the strips put on the panel
+        for w, (rect, data) in zip(changed, patches):
+            x1, y1, x2, y2 = rect
+            self.layers[0].paste(Image.frombytes('1', (x2 - x1, y2 - y1), data), (x1, y1))
+            self.hashes[w] = w.content_hash(ctx)
+        self.generation += 1
+        return changed, patches